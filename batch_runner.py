@@ -0,0 +1,233 @@
+"""
+Batch inference over a JSONL file of requests against the MLflow Gateway `chat` endpoint.
+
+每行輸入為一個 JSON 物件，例如：
+    {"request_id": "r-1", "prompt": "...", "params": {"max_tokens": 500}}
+
+結果逐筆附加寫入輸出 JSONL，並定期寫入 <output>.ckpt 檢查點；
+程式中斷後以相同參數重新執行，會跳過已成功的請求，只補跑剩下的部分。
+連線錯誤、429 與 5xx 會在同一次執行中以指數退避重試 --retries 次；
+格式錯誤的輸入行或缺少 prompt 的請求寫成 {"error": ...} 記錄，不會中斷整批。
+
+    python batch_runner.py requests.jsonl results.jsonl --concurrency 8 --rate 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+DEFAULT_GATEWAY_URL = os.getenv("MLFLOW_DEPLOYMENTS_TARGET", "http://localhost:7000")
+# 這些狀態碼視為暫時性錯誤，會退避後重試
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """簡單的 token bucket：平均每秒最多 rate 個請求，允許 burst 個瞬間突發"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """
+    記錄進度：watermark 之前的輸入行都已成功完成，重跑時可以不解析直接跳過；
+    watermark 之後零星完成的請求則由輸出檔中的 id 判斷。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = 0
+        self._completed: set[int] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.watermark = json.load(f).get("watermark", 0)
+
+    def mark_done(self, line_no: int):
+        self._completed.add(line_no)
+        while self.watermark in self._completed:
+            self._completed.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"watermark": self.watermark, "updated_at": time.time()}, f)
+        os.replace(tmp_path, self.path)
+
+
+def load_completed_ids(output_path: str, id_field: str) -> set:
+    """掃描既有輸出檔，收集已成功完成的請求 id（失敗的請求重跑時會再試一次）"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 上次中斷時寫到一半的行
+            if "error" not in record:
+                done.add(record.get(id_field))
+    return done
+
+
+def iter_requests(input_path: str, skip_lines: int):
+    """
+    逐行讀取輸入檔，不會一次載入整個檔案，回傳 (行號, 請求, 錯誤訊息)：
+    空行的請求為 None；無法解析或不是 JSON 物件的行，請求為 None 並附上錯誤訊息
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            if line_no < skip_lines:
+                continue
+            if not line.strip():
+                yield line_no, None, None
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"invalid JSON on line {line_no + 1}: {e}"
+                continue
+            if not isinstance(request, dict):
+                yield line_no, None, f"line {line_no + 1} is not a JSON object"
+                continue
+            yield line_no, request, None
+
+
+async def run_batch(args):
+    checkpoint = Checkpoint(f"{args.output}.ckpt")
+    completed_ids = load_completed_ids(args.output, args.id_field)
+    limiter = RateLimiter(args.rate, burst=args.concurrency)
+    url = f"{args.gateway_url.rstrip('/')}/endpoints/{args.endpoint}/invocations"
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    counters = {"ok": 0, "error": 0, "skipped": 0}
+    started = time.monotonic()
+
+    # 空行與已完成的行不會進入工作佇列，直接標記為完成讓 watermark 能往前推進
+    def mark_done(line_no):
+        checkpoint.mark_done(line_no)
+        if sum(counters.values()) % args.checkpoint_every == 0:
+            checkpoint.save()
+
+    with open(args.output, "a", encoding="utf-8") as out:
+
+        def finish(line_no, record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in record:
+                counters["error"] += 1
+            else:
+                counters["ok"] += 1
+                mark_done(line_no)
+            if args.progress_every and sum(counters.values()) % args.progress_every == 0:
+                elapsed = time.monotonic() - started
+                print(f"[batch] ok={counters['ok']} error={counters['error']} "
+                      f"skipped={counters['skipped']} elapsed={elapsed:.1f}s")
+
+        async def send(client: httpx.AsyncClient, payload: dict, record: dict):
+            """送出請求，暫時性錯誤以 retry_backoff * 2^n 秒的間隔重試"""
+            for attempt in range(args.retries + 1):
+                if attempt:
+                    await asyncio.sleep(args.retry_backoff * 2 ** (attempt - 1))
+                record["attempts"] = attempt + 1
+                await limiter.acquire()
+                try:
+                    response = await client.post(url, json=payload)
+                except httpx.TransportError:
+                    if attempt == args.retries:
+                        raise
+                    continue
+                if response.status_code in RETRY_STATUS_CODES and attempt < args.retries:
+                    continue
+                response.raise_for_status()
+                return response.json()
+
+        async def worker(client: httpx.AsyncClient):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                line_no, request = item
+                record = {args.id_field: request.get(args.id_field, line_no)}
+                t0 = time.monotonic()
+                # 單筆請求的任何錯誤都寫成 error 記錄，worker 繼續處理下一筆，避免佇列塞滿後整批卡住
+                try:
+                    if args.prompt_field not in request:
+                        raise ValueError(f"missing {args.prompt_field!r} field")
+                    payload = {"prompt": request[args.prompt_field], **(request.get("params") or {})}
+                    record["response"] = await send(client, payload, record)
+                except Exception as e:
+                    record["error"] = str(e) or type(e).__name__
+                record["latency"] = time.monotonic() - t0
+                finish(line_no, record)
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(args.timeout)) as client:
+            workers = [asyncio.create_task(worker(client)) for _ in range(args.concurrency)]
+            try:
+                for line_no, request, error in iter_requests(args.input, checkpoint.watermark):
+                    if error is not None:
+                        finish(line_no, {args.id_field: line_no, "error": error})
+                        continue
+                    if request is None:
+                        mark_done(line_no)
+                        continue
+                    if request.get(args.id_field, line_no) in completed_ids:
+                        counters["skipped"] += 1
+                        mark_done(line_no)
+                        continue
+                    await queue.put((line_no, request))
+            finally:
+                # 讀取輸入失敗時也要等進行中的請求寫完，才關閉輸出檔
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+
+    checkpoint.save()
+    elapsed = time.monotonic() - started
+    print(f"[batch] done: ok={counters['ok']} error={counters['error']} "
+          f"skipped={counters['skipped']} elapsed={elapsed:.1f}s")
+    return counters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts against the MLflow Gateway.")
+    parser.add_argument("input", help="Input JSONL, one request per line")
+    parser.add_argument("output", help="Output JSONL, appended to on resume")
+    parser.add_argument("--gateway-url", default=DEFAULT_GATEWAY_URL)
+    parser.add_argument("--endpoint", default="chat")
+    parser.add_argument("--id-field", default="request_id")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max in-flight requests")
+    parser.add_argument("--rate", type=float, default=0, help="Max requests per second, 0 = unlimited")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Retries per request on connection errors, 429 and 5xx")
+    parser.add_argument("--retry-backoff", type=float, default=1.0,
+                        help="Initial retry delay in seconds, doubled on each retry")
+    parser.add_argument("--checkpoint-every", type=int, default=10)
+    parser.add_argument("--progress-every", type=int, default=10)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_batch(parse_args()))
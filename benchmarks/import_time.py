@@ -0,0 +1,110 @@
+"""
+Import-time and memory profile of the gateway plugin and llm_api.
+
+每個模組在獨立的 python 子行程中以 -X importtime 匯入，回報總匯入時間、匯入後的 RSS
+與累計耗時最多的模組；--check 會在超過預算時以非零狀態結束，可放進部署前的檢查：
+
+    python -m benchmarks.import_time --check --max-seconds 1.5 --max-rss-mb 200
+    python -m benchmarks.import_time --module generate_rules --top 30
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["ml_mlflow_provider.providers", "ml_mlflow_provider.metrics", "llm_api"]
+# 每個模組的預設預算，--check 與 tests/test_import_time.py 共用
+MAX_SECONDS = 2.0
+MAX_RSS_MB = 250
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子行程：量測匯入耗時與匯入後的最大 RSS，結果以 JSON 印在 stdout 最後一行
+_CHILD = """
+import resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+import json
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb //= 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss_kb / 1024, "modules": len(sys.modules)}}))
+"""
+
+
+def parse_importtime(stderr, module):
+    """解析 -X importtime 輸出，回傳 [(模組, 自身微秒, 累計微秒)]，不含子行程量測本身在之後匯入的模組"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        # 目標模組（最外層）完成匯入後的紀錄都屬於量測程式本身
+        if name[1:] == module:
+            break
+    return rows
+
+
+def profile(module, python=sys.executable):
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", _CHILD.format(module=module)],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        return {"module": module, "error": error}
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["module"] = module
+    report["imports"] = parse_importtime(result.stderr, module)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile import time and RSS of the serving modules.")
+    parser.add_argument("--module", action="append", help="Module to import (repeatable)")
+    parser.add_argument("--top", type=int, default=15, help="Show the N slowest imports by cumulative time")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero when a budget is exceeded")
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS, help="Import time budget per module")
+    parser.add_argument("--max-rss-mb", type=float, default=MAX_RSS_MB, help="RSS budget per module after import")
+    args = parser.parse_args(argv)
+
+    reports = [profile(module) for module in args.module or DEFAULT_MODULES]
+    failures = []
+    for report in reports:
+        if "error" in report:
+            failures.append(f"{report['module']}: import failed ({report['error']})")
+            continue
+        if report["seconds"] > args.max_seconds:
+            failures.append(f"{report['module']}: {report['seconds']:.2f}s > {args.max_seconds:.2f}s")
+        if report["rss_mb"] > args.max_rss_mb:
+            failures.append(f"{report['module']}: {report['rss_mb']:.0f} MB > {args.max_rss_mb:.0f} MB")
+
+    if args.json:
+        for report in reports:
+            report["imports"] = sorted(report.get("imports", []), key=lambda row: -row[2])[:args.top]
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            if "error" in report:
+                print(f"{report['module']}: import failed: {report['error']}\n")
+                continue
+            print(f"{report['module']}: {report['seconds']:.3f}s, {report['rss_mb']:.1f} MB RSS, "
+                  f"{report['modules']} modules loaded")
+            for name, self_us, cumulative_us in sorted(report["imports"], key=lambda row: -row[2])[:args.top]:
+                print(f"  {cumulative_us / 1000:9.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+            print()
+
+    if args.check:
+        for failure in failures:
+            print(f"BUDGET EXCEEDED {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Mock Ollama server for benchmarking llm_api.py without a GPU.
+
+模擬 /api/generate 與 /api/chat 的 NDJSON 串流，延遲可調整：
+    MOCK_PROMPT_LATENCY_MS  首個 token 之前的固定延遲（模擬 prompt evaluation）
+    MOCK_TOKEN_LATENCY_MS   每個 token 之間的延遲
+    MOCK_TOKENS             每次回覆的 token 數
+    MOCK_ERROR_RATE         以此機率回傳 500，用於測試錯誤處理
+
+    uvicorn benchmarks.mock_ollama:app --port 11434
+"""
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PROMPT_LATENCY_MS = float(os.getenv("MOCK_PROMPT_LATENCY_MS", "50"))
+TOKEN_LATENCY_MS = float(os.getenv("MOCK_TOKEN_LATENCY_MS", "20"))
+TOKENS = int(os.getenv("MOCK_TOKENS", "64"))
+ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+
+app = FastAPI()
+
+
+async def generate_chunks(payload: dict, chat: bool):
+    """依設定的延遲逐 token 產生 Ollama 格式的 chunk，最後一行附上 eval 統計"""
+    started = time.perf_counter_ns()
+    prompt = json.dumps(payload.get("messages") or payload.get("prompt", ""))
+    max_tokens = payload.get("options", {}).get("num_predict") or TOKENS
+    tokens = min(TOKENS, max_tokens) if max_tokens > 0 else TOKENS
+
+    await asyncio.sleep(PROMPT_LATENCY_MS / 1000)
+    prompt_done = time.perf_counter_ns()
+    for i in range(tokens):
+        if i:
+            await asyncio.sleep(TOKEN_LATENCY_MS / 1000)
+        text = f"tok{i} "
+        chunk = {"model": payload.get("model"), "done": False}
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        yield json.dumps(chunk) + "\n"
+
+    final = {
+        "model": payload.get("model"),
+        "done": True,
+        "done_reason": "stop",
+        "total_duration": time.perf_counter_ns() - started,
+        "prompt_eval_count": len(prompt) // 4,
+        "prompt_eval_duration": prompt_done - started,
+        "eval_count": tokens,
+        "eval_duration": time.perf_counter_ns() - prompt_done,
+    }
+    if chat:
+        final["message"] = {"role": "assistant", "content": ""}
+    else:
+        final["response"] = ""
+    yield json.dumps(final) + "\n"
+
+
+async def handle(request: Request, chat: bool):
+    payload = await request.json()
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        return JSONResponse({"error": "mock failure"}, status_code=500)
+    chunks = generate_chunks(payload, chat)
+    if payload.get("stream", True):
+        return StreamingResponse(chunks, media_type="application/x-ndjson")
+    # stream=false：合併成單一 JSON 回應
+    text = []
+    final = {}
+    async for line in chunks:
+        final = json.loads(line)
+        text.append(final["message"]["content"] if chat else final["response"])
+    if chat:
+        final["message"]["content"] = "".join(text)
+    else:
+        final["response"] = "".join(text)
+    return JSONResponse(final)
+
+
+@app.post("/api/generate")
+async def api_generate(request: Request):
+    return await handle(request, chat=False)
+
+
+@app.post("/api/chat")
+async def api_chat(request: Request):
+    return await handle(request, chat=True)
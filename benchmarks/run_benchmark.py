@@ -0,0 +1,218 @@
+"""
+Load test for llm_api.py /chat and the MLflow Gateway endpoint.
+
+    # 1. 啟動 mock Ollama 與 llm_api
+    uvicorn benchmarks.mock_ollama:app --port 11434
+    uvicorn llm_api:app --port 8000
+    # 2. 以 16 個並行連線送出 200 個請求，結果寫成 JSON 並與 baseline 比較
+    python -m benchmarks.run_benchmark --target chat --url http://localhost:8000 \\
+        --concurrency 16 --requests 200 --stream --output results.json \\
+        --compare benchmarks/baselines/chat_stream.json
+
+--prompts 可指定 JSONL（例如 requests.jsonl）重播實際的請求內容，
+--save-baseline 會把結果存成 benchmarks/baselines/<name>.json 供之後的版本比較。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import httpx
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+DEFAULT_PROMPTS = [
+    "Hello!",
+    "Summarize the purpose of a pg_pin in a Liberty file.",
+    "List three consistency rules for isolation cells in an NLDM library.",
+]
+# 比較 baseline 時，數值越小越好的指標；其餘（吞吐量）越大越好
+LOWER_IS_BETTER = ("latency_p50", "latency_p90", "latency_p99", "ttft_p50", "ttft_p99", "error_rate")
+# 不比較的欄位：總耗時會隨 --requests 改變，吞吐量已反映同樣的資訊
+NOT_COMPARED = ("duration_s",)
+
+
+def load_prompts(path, field):
+    """從 JSONL 讀取 prompt；沒有指定 field 的行會嘗試 prompt / body / messages。"""
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            value = record.get(field) or record.get("prompt") or record.get("body") or record.get("messages")
+            if value:
+                prompts.append(value)
+    return prompts
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None when there are no samples."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_request(args, prompt):
+    """依 target 組出 URL 與 payload。"""
+    messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+    if args.target == "chat":
+        url = f"{args.url.rstrip('/')}/chat"
+        payload = {"messages": messages, "max_tokens": args.max_tokens, "stream": args.stream}
+        return url, {"api_key": args.api_key}, payload
+    url = f"{args.url.rstrip('/')}/endpoints/{args.endpoint}/invocations"
+    text = prompt if isinstance(prompt, str) else "\n".join(m["content"] for m in prompt)
+    return url, {}, {"prompt": text, "max_tokens": args.max_tokens, "stream": args.stream}
+
+
+async def one_request(client, args, prompt, samples):
+    url, params, payload = build_request(args, prompt)
+    started = time.perf_counter()
+    sample = {"ok": False, "latency": None, "ttft": None, "chunks": 0}
+    try:
+        async with client.stream("POST", url, params=params, json=payload) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                sample["error"] = f"HTTP {response.status_code}"
+            else:
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    if sample["ttft"] is None:
+                        sample["ttft"] = time.perf_counter() - started
+                    sample["chunks"] += 1
+                sample["ok"] = True
+    except httpx.HTTPError as e:
+        sample["error"] = type(e).__name__
+    sample["latency"] = time.perf_counter() - started
+    samples.append(sample)
+
+
+async def run(args):
+    prompts = load_prompts(args.prompts, args.prompt_field) if args.prompts else DEFAULT_PROMPTS
+    prompt_cycle = itertools.cycle(prompts)
+    samples = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(args.timeout), limits=limits) as client:
+        # 暖機請求不列入統計（模型載入、連線建立）
+        for _ in range(args.warmup):
+            await one_request(client, args, next(prompt_cycle), [])
+
+        async def bounded(prompt):
+            async with semaphore:
+                await one_request(client, args, prompt, samples)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(next(prompt_cycle)) for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(args, samples, elapsed)
+
+
+def summarize(args, samples, elapsed):
+    ok = [s for s in samples if s["ok"]]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+    errors = {}
+    for s in samples:
+        if not s["ok"]:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+    return {
+        "config": {
+            "target": args.target,
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "stream": args.stream,
+            "max_tokens": args.max_tokens,
+            "prompts": args.prompts,
+        },
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+        "timestamp": time.time(),
+        "results": {
+            "duration_s": elapsed,
+            "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+            "chunks_per_s": sum(s["chunks"] for s in ok) / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "ttft_p50": percentile(ttfts, 50),
+            "ttft_p99": percentile(ttfts, 99),
+            "error_rate": (len(samples) - len(ok)) / len(samples) if samples else 0.0,
+            "errors": errors,
+        },
+    }
+
+
+def compare(current, baseline, tolerance):
+    """回傳超出容許範圍的退步項目 [(指標, baseline, 目前值, 變化比例)]"""
+    regressions = []
+    for name, base_value in baseline["results"].items():
+        if name in NOT_COMPARED:
+            continue
+        value = current["results"].get(name)
+        if not isinstance(base_value, (int, float)) or not isinstance(value, (int, float)):
+            continue
+        if base_value == 0:
+            change = 0.0 if value == 0 else float("inf")
+        else:
+            change = (value - base_value) / base_value
+        worse = change > tolerance if name in LOWER_IS_BETTER else change < -tolerance
+        if worse:
+            regressions.append((name, base_value, value, change))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark llm_api /chat or the MLflow Gateway endpoint.")
+    parser.add_argument("--target", choices=("chat", "gateway"), default="chat")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="chat", help="Gateway endpoint name (target=gateway)")
+    parser.add_argument("--api-key", default="kelly", help="llm_api key (target=chat)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--stream", action="store_true", help="Request streaming responses (measures TTFT)")
+    parser.add_argument("--prompts", help="JSONL file of prompts to replay, e.g. requests.jsonl")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Store results as baselines/NAME.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression (0.1 = 10%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2)
+    print(text)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for name, base_value, value, change in regressions:
+            print(f"REGRESSION {name}: {base_value:.4g} -> {value:.4g} ({change:+.1%})", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
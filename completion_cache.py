@@ -0,0 +1,101 @@
+"""
+Thread-safe completion cache for the DSPy LM client.
+
+記憶體 + 磁碟兩層快取，key 為 API 位址、prompt 與取樣參數的 sha256：
+  - 磁碟檔案先寫暫存檔再 rename，其他 thread / process 不會讀到寫一半的檔案
+  - 同一個 key 同時只會呼叫一次 API，其他 thread 等待並取得相同結果
+  - 磁碟讀寫失敗時只略過快取，不影響回答
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionCache:
+    """prompt + 參數 → completion；cache_dir 為 None 時只使用記憶體"""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self._memory: dict[str, str] = {}
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0}
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                completion = json.load(f)["completion"]
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._lock:
+            self._memory[key] = completion
+        return completion
+
+    def set(self, key: str, completion: str):
+        with self._lock:
+            self._memory[key] = completion
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"completion": completion}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to write completion cache %s: %s", path, e)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_or_call(self, key: str, call: Callable[[], str]) -> str:
+        """命中時回傳快取內容，否則呼叫 call() 並存入快取；同一個 key 的並行呼叫只會執行一次 call()"""
+        completion = self.get(key)
+        if completion is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                # 等待期間可能已由其他 thread 完成
+                completion = self.get(key)
+                if completion is None:
+                    try:
+                        completion = call()
+                        self.set(key, completion)
+                    finally:
+                        with self._lock:
+                            self._key_locks.pop(key, None)
+                    self._count(hit=False)
+                    return completion
+        self._count(hit=True)
+        return completion
+
+    def _count(self, hit: bool):
+        with self._lock:
+            self._counters["lookups"] += 1
+            self._counters["hits"] += hit
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._memory))
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
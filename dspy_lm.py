@@ -0,0 +1,67 @@
+"""
+DSPy LM client for the in-house completion API.
+
+所有 thread 共用同一個具連線池與重試的 requests.Session，回應以 CompletionCache 快取，
+重跑 prompt 最佳化時相同的 prompt + 參數不會再次呼叫 API。
+"""
+import os
+
+import requests
+from dspy import LM
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from completion_cache import CompletionCache
+
+# 候選 prompt 評估與 Evaluate 同時使用的 thread 數
+NUM_THREADS = int(os.getenv("DSPY_NUM_THREADS", "8"))
+# LM 回應的磁碟快取目錄，重跑最佳化時相同的 prompt + 參數直接讀取
+LM_CACHE_DIR = os.getenv("DSPY_LM_CACHE_DIR", ".dspy_lm_cache")
+
+
+def make_session(pool_size=NUM_THREADS, retries=3):
+    """共用、具連線池的 Session；連線錯誤、429 與 5xx 以指數退避重試"""
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class MyCustomAPI(LM):
+    def __init__(self, api_url, api_key, cache_dir=LM_CACHE_DIR, session=None, timeout=300):
+        super().__init__()
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        # 多個 thread 共用同一個 Session 與連線池
+        self.session = session or make_session()
+        self.cache = CompletionCache(cache_dir)
+
+    def basic_request(self, prompt, **kwargs):
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json',
+        }
+        payload = {
+            'prompt': prompt,
+            'max_tokens': kwargs.get('max_tokens', 300),
+            'temperature': kwargs.get('temperature', 0.1),
+        }
+
+        def call():
+            response = self.session.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+
+            # 依照你API回傳的結構調整以下
+            return result['completion']
+
+        return self.cache.get_or_call(CompletionCache.key({"api_url": self.api_url, **payload}), call)
@@ -1,36 +1,11 @@
 import dspy
-import dspy
 from dspy.evaluate import Evaluate
-import dspy
 from dspy.teleprompt import BootstrapFewShot
 lm = dspy.LM('openai/gpt-3.5-turbo')
 dspy.configure(lm=lm)
-from dspy import LM
-import requests
 from dspy.teleprompt import MIPROv2
-class MyCustomAPI(LM):
-    def __init__(self, api_url, api_key):
-        super().__init__()
-        self.api_url = api_url
-        self.api_key = api_key
-
-    def basic_request(self, prompt, **kwargs):
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json',
-        }
-        payload = {
-            'prompt': prompt,
-            'max_tokens': kwargs.get('max_tokens', 300),
-            'temperature': kwargs.get('temperature', 0.1),
-        }
-        response = requests.post(self.api_url, headers=headers, json=payload)
-        result = response.json()
-        
-        # 依照你API回傳的結構調整以下
-        completion = result['completion']
 
-        return completion
+from dspy_lm import NUM_THREADS, MyCustomAPI
 
 # 設定你自家的LLM API
 my_llm = MyCustomAPI(
@@ -76,8 +51,8 @@ train_example_2 = dspy.Example(
         }
     ],
     rules=(
-        1.
-        2. 
+        "1.\n"
+        "2."
     )
 ).with_inputs('pins', 'pg_pins')
 
@@ -89,7 +64,8 @@ def evaluate_rules(pred, gold):
     return all(rule.strip() in pred.rules for rule in expected_rules)
 
 # Step 5: Prompt Tuning using MIPRO (Zero-shot，不給答案)
-teleprompter = MIPROv2(metric=evaluate_rules, verbose=True)
+# 候選 prompt 在 trainset 上的評估以 NUM_THREADS 個 thread 並行執行
+teleprompter = MIPROv2(metric=evaluate_rules, num_threads=NUM_THREADS, verbose=True)
 
 # 使用訓練資料優化 prompt（不會將答案顯示給prompt）
 optimized_predictor = teleprompter.compile(
@@ -103,6 +79,10 @@ optimized_predictor = teleprompter.compile(
 print("\n🔑 Optimized Zero-shot Prompt (via Signature):\n")
 print(optimized_predictor) 
 
+# 以相同的 thread 數並行評估最佳化後的結果
+evaluator = Evaluate(devset=trainset, metric=evaluate_rules, num_threads=NUM_THREADS, display_progress=True)
+evaluator(optimized_predictor)
+
 # Step 6: 新資料測試
 test_input = {
     "pins": [
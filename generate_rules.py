@@ -1,111 +1,168 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import time
+
 from liberty.parser import parse_liberty
-from llm_request import request_internal_llm
-from langchain.schema import HumanMessage
 import mlflow 
 from mlflow.tracing.fluent import start_span
 
-mlflow.set_experiment("LangChain Tracing")
-mlflow.langchain.autolog()
+from liberty_index import load_or_build
+from mlflow_tracking import make_tracker
+from liberty_prompt import estimate_tokens, extract_cell, format_cell, serialize_library
+from prompt_registry import PromptRegistry
+from rule_set import merge_rule_sets, rule_similarity
 
+MLFLOW_EXPERIMENT = "LangChain Tracing"
 
-def generate_initial_prompt(cell_group):
-    """Generate initial consistency rules from the NLDM Lib file."""
-    prompt_template = f'''
-    Please generate consistency rules based on the NLDM Lib File. The rules are as follows:
 
-    Rule 1: In the pg_pin, if a pin contains the switch_function attribute, it must have the switch_pin: true property.
-    Example: pg_pin(VDDAI) {{ switch_function: "SD"; }}
-    
-    Please generate additional consistency rules and present them in human language.
-    {cell_group}
-    '''
-    # cell_group='kelly'
-    # prompt_template = f'hello {cell_group}'
-    return prompt_template
+def setup_tracking(experiment=MLFLOW_EXPERIMENT, langchain_autolog=False):
+    """Select the MLflow experiment; LangChain autologging is only enabled on request."""
+    mlflow.set_experiment(experiment)
+    if langchain_autolog:
+        mlflow.langchain.autolog()
 
-def evaluate_rules(llm_response, cell_group):
-    """Evaluate, refine, and prioritize the generated rules."""
-    prompt_template = f'''
-    You are an experienced NLDM Lib CAD engineer, and your task is to verify the accuracy of each rule and provide modification suggestions.
 
-    Below are my generated rules:
-    {llm_response}
+# 選用的 semantic cache（--semantic-cache），近似重複的 prompt 直接回傳先前的回答
+SEMANTIC_CACHE = None
+# 只有 generate_initial 以相似度比對（相似 cell 的初始規則可共用）；evaluate_rules / re_answer 的回答
+# 取決於當下的規則內容，只接受完全相同的 prompt
+SEMANTIC_NAMESPACES = ("generate_initial",)
+
+
+def ask_llm(prompt_text, namespace="", cache_stats=None, embed_text=None, scope=None):
+    """Send one human message to the internal LLM; LangChain is imported on first use.
+
+    With SEMANTIC_CACHE set, a cached answer for the same namespace (template) is
+    reused: by similarity of embed_text (the variable part of the prompt) for
+    SEMANTIC_NAMESPACES, otherwise only for an identical prompt. Entries stored
+    under the same scope (the current run) are never returned, so later iterations
+    of a run cannot get an earlier iteration's answer. cache_stats accumulates this
+    run's lookups, hits and estimated tokens saved.
+    """
+    def call():
+        from langchain.schema import HumanMessage
+        from llm_request import request_internal_llm
 
-    And the corresponding Lib file content:
-    {cell_group}
+        return request_internal_llm([HumanMessage(content=prompt_text)])
 
-    # The Lib file content is correct. Please carefully review each rule for accuracy and provide your assessment. 
+    if SEMANTIC_CACHE is None:
+        return call()
+    return SEMANTIC_CACHE.get_or_call(
+        prompt_text, call, namespace=namespace, stats=cache_stats, embed_text=embed_text, scope=scope,
+        semantic=namespace in SEMANTIC_NAMESPACES,
+    )
 
-    # **Output Format**
-    # Rule X: Rule Description  
-    # Example:  
-    # Interpretation: Explain the underlying physical meaning in a way that junior engineers can understand.  
-    # Recommendation:  
 
-    # Please prioritize the rules based on accuracy and keep only the **top 10 most important rules**.
-    # '''
-    # cell_group='kelly'
-    # prompt_template = f'hello {cell_group}'
-    return prompt_template
+PROMPTS = PromptRegistry.from_env()
+# refine_rules 使用的模板，每次執行都會記錄其版本與內容 hash
+REFINE_TEMPLATES = ("library_context", "generate_initial", "evaluate_rules", "re_answer")
+
+
+def library_context(cell_group):
+    """Static Lib file context placed at the start of every prompt that needs it.
+
+    Keeping it as an identical prefix lets Ollama reuse the cached prompt
+    evaluation (KV cache) across the generate and evaluate steps of every iteration.
+    """
+    return PROMPTS.render("library_context", cell_group=cell_group)
+
+def generate_initial_prompt(cell_group):
+    """Generate initial consistency rules from the NLDM Lib file."""
+    return library_context(cell_group) + PROMPTS.render("generate_initial")
+
+def evaluate_rules(llm_response, cell_group):
+    """Evaluate, refine, and prioritize the generated rules."""
+    return library_context(cell_group) + PROMPTS.render("evaluate_rules", llm_response=llm_response)
 
 def re_answer(reflect_response):
     """Reformat and finalize the refined rules."""
-    reAnswer_prompt_template = f'''
-    Based on {reflect_response}, display the final selected rules. 
-    Only output the rules in the following format:
-    
-    Rule:
-    Example:
-    Interpretation:
-    '''
-    # cell_group='kelly'
-    # prompt_template = f'hello {cell_group}'
-   
-    return reAnswer_prompt_template 
-
-def refine_rules(cell_group, max_iteration=2):
-    """Iteratively refine and format the consistency rules with MLflow tracking."""
+    return PROMPTS.render("re_answer", reflect_response=reflect_response)
+
+def log_prompt_templates(log_params, log_metrics):
+    """Log the version hash and static token estimate of every template refine_rules uses."""
+    log_params({f"prompt_template.{name}": ref for name, ref in PROMPTS.refs(REFINE_TEMPLATES).items()})
+    log_metrics({f"prompt_template_tokens.{name}": PROMPTS.get(name).static_tokens for name in REFINE_TEMPLATES})
+
+def log_semantic_cache(log_params, log_metrics, cache_stats):
+    """Log the semantic cache settings and hit rate / estimated tokens saved in cache_stats."""
+    if SEMANTIC_CACHE is None:
+        return
+    log_params(SEMANTIC_CACHE.params())
+    lookups = cache_stats.get("lookups", 0)
+    log_metrics({
+        "semantic_cache_lookups": lookups,
+        "semantic_cache_hits": cache_stats.get("hits", 0),
+        "semantic_cache_hit_rate": cache_stats.get("hits", 0) / lookups if lookups else 0.0,
+        "semantic_cache_tokens_saved": cache_stats.get("tokens_saved", 0),
+    })
+
+def refine_rules(cell_group, max_iteration=2, run_name=None, parent_run_id=None, prompt_stats=None,
+                 convergence_threshold=0.9, tracking="buffered"):
+    """Iteratively refine and format the consistency rules with MLflow tracking.
+
+    Stops early once the parsed rule sets of two consecutive rounds overlap by at
+    least convergence_threshold (Jaccard similarity of normalized rule statements).
+    With tracking="buffered", params, metrics and text artifacts are uploaded from a
+    background thread and large span payloads are replaced by a hash reference.
+    """
     
     # 開啟 MLflow run，所有記錄會在此 run 下進行
-    with mlflow.start_run() as run:
+    # （在 worker thread 中沒有 active run，需以 parent_run_id 掛到上層 run 底下）
+    with mlflow.start_run(run_name=run_name, parent_run_id=parent_run_id) as run, \
+            make_tracker(tracking, run.info.run_id) as tracker:
         
         
         # 記錄輸入參數，例如 cell_group 的長度
-        with mlflow.start_run(nested=True):
-            mlflow.log_param("cell_group_length", len(cell_group))
+        tracker.log_params({"cell_group_length": len(cell_group), "max_iteration": max_iteration})
+        # 記錄使用的模板版本，方便依版本比較成本與延遲
+        log_prompt_templates(tracker.log_params, tracker.log_metrics)
+        # 使用精簡序列化時，記錄節省的 prompt token 數
+        if prompt_stats:
+            tracker.log_metrics(prompt_stats)
+        # 本 run 的 semantic cache 命中統計
+        cache_stats = {}
         # 整個流程的根 span
         with start_span(name="RefineRulesFlow") as root_span:
-            root_span.set_inputs({"cell_group": cell_group})
+            root_span.set_inputs({"cell_group": tracker.span_value(cell_group)})
             # Step 1: 生成初始規則
             print("Generating initial rules...")
             generate_initial_prompt_text = generate_initial_prompt(cell_group)
             
             with start_span(name="generate_initial_prompt") as sp1:
                 generate_initial_prompt_text = generate_initial_prompt(cell_group)
-                sp1.set_inputs({"cell_group": cell_group, "prompt_text": generate_initial_prompt_text})
-                messages = [HumanMessage(content=generate_initial_prompt_text)]
-                rules = request_internal_llm(messages)
+                sp1.set_inputs({
+                    "cell_group": tracker.span_value(cell_group),
+                    "prompt_text": tracker.span_value(generate_initial_prompt_text),
+                })
+                rules = ask_llm(generate_initial_prompt_text, "generate_initial", cache_stats,
+                                embed_text=cell_group, scope=run.info.run_id)
                 sp1.set_outputs({"rules": rules})
-                mlflow.log_text(rules, artifact_file="initial_rules.txt")
+                tracker.log_text(rules, artifact_file="initial_rules.txt")
                 print("Initial Rules Generated:\n", rules)
             
 
             # 進入迭代調整規則的過程
+            iteration_seconds = []
+            iteration_tokens = []
             for i in range(max_iteration):
                 print(f"\nIteration {i+1}: Evaluating and refining rules...")
-                # 使用嵌套 run 來記錄當前迭代參數
-                with mlflow.start_run(nested=True):
-                    mlflow.log_param("iteration", i+1)
+                iteration_started = time.monotonic()
+                # 以 step 記錄當前迭代，不再為了單一參數開啟嵌套 run
+                tracker.log_metric("iteration", i+1, step=i+1)
 
                 with start_span(name="evaluate_rules") as sp2:
                     # Step 2: 驗證並過濾規則
                     evaluate_rules_prompt_text = evaluate_rules(rules, cell_group)
-                    sp2.set_inputs({"previous_rules": rules, "eval_prompt_text": evaluate_rules_prompt_text})
-                    messages = [HumanMessage(content=evaluate_rules_prompt_text)]
-                    refined_rules = request_internal_llm(messages)
+                    sp2.set_inputs({
+                        "previous_rules": rules,
+                        "eval_prompt_text": tracker.span_value(evaluate_rules_prompt_text),
+                    })
+                    refined_rules = ask_llm(evaluate_rules_prompt_text, "evaluate_rules", cache_stats,
+                                            scope=run.info.run_id)
                     # 記錄此次迭代生成的規則
                     sp2.set_outputs({"refined_rules": refined_rules})
-                    mlflow.log_text(refined_rules, artifact_file=f"refined_rules_iter_{i+1}.txt")
+                    tracker.log_text(refined_rules, artifact_file=f"refined_rules_iter_{i+1}.txt")
                     print("Refined Rules:\n", refined_rules)
 
                 with start_span(name="re_answer") as sp3:
@@ -114,15 +171,21 @@ def refine_rules(cell_group, max_iteration=2):
 
                     # 把 prompt 記錄為inputs
                     sp3.set_inputs({"reAnswer_prompt_text":reAnswer_prompt_text})
-                    messages = [HumanMessage(content=reAnswer_prompt_text)]
-                    formatted_rules = request_internal_llm(messages)
+                    formatted_rules = ask_llm(reAnswer_prompt_text, "re_answer", cache_stats, scope=run.info.run_id)
                     sp3.set_outputs({"formatted_rules": formatted_rules})
-                    mlflow.log_text(formatted_rules, artifact_file=f"formatted_rules_iter_{i+1}.txt")
+                    tracker.log_text(formatted_rules, artifact_file=f"formatted_rules_iter_{i+1}.txt")
                     print("Formatted Rules:\n", formatted_rules)
                 
-                # 檢查是否收斂 (格式化後的規則與前一次生成的規則一致)
-                if formatted_rules.strip() == rules.strip():
-                    print("Rules have converged, stopping iteration early.")
+                iteration_seconds.append(time.monotonic() - iteration_started)
+                iteration_tokens.append(sum(map(estimate_tokens, (
+                    evaluate_rules_prompt_text, refined_rules, reAnswer_prompt_text, formatted_rules,
+                ))))
+
+                # 檢查是否收斂 (格式化後的規則集合與前一次的規則集合幾乎相同)
+                similarity = rule_similarity(formatted_rules, rules)
+                tracker.log_metric("rule_similarity", similarity, step=i+1)
+                if similarity >= convergence_threshold:
+                    print(f"Rules have converged (similarity {similarity:.2f}), stopping iteration early.")
                     break
                 
                 # 更新規則以進行下一輪調整
@@ -130,20 +193,159 @@ def refine_rules(cell_group, max_iteration=2):
 
             root_span.set_outputs({"final_rules": formatted_rules})
 
+        # 記錄提早收斂省下的迭代數，以及依已執行迭代的平均值估算省下的 token 與時間
+        iterations_run = len(iteration_seconds)
+        iterations_skipped = max_iteration - iterations_run
+        tracker.log_metrics({
+            "iterations_run": iterations_run,
+            "iterations_skipped": iterations_skipped,
+            "estimated_tokens_saved": iterations_skipped * sum(iteration_tokens) / max(iterations_run, 1),
+            "estimated_seconds_saved": iterations_skipped * sum(iteration_seconds) / max(iterations_run, 1),
+        })
+        log_semantic_cache(tracker.log_params, tracker.log_metrics, cache_stats)
+
         # 最後將最終結果記錄下來
-        mlflow.log_text(formatted_rules, artifact_file="final_rules.txt")
+        tracker.log_text(formatted_rules, artifact_file="final_rules.txt")
         return formatted_rules
 
 
-### 🔹 Read and parse the .lib file
-with open('test.lib',"r") as f:
-    lib_content = f.read()
-parsed_lib = parse_liberty(lib_content)
-cell_group = str(parsed_lib)
+def split_cells(parsed_lib, compact=False):
+    """Split a parsed Liberty library into (cell_name, cell_group_text) pairs."""
+    if compact:
+        return [(cell["name"], format_cell(cell)) for cell in map(extract_cell, parsed_lib.get_groups("cell"))]
+    return [(str(cell.args[0]), str(cell)) for cell in parsed_lib.get_groups("cell")]
+
+
+def refine_rules_per_cell(cells, max_iteration=2, max_workers=4, convergence_threshold=0.9, tracking="buffered"):
+    """Run refine_rules for every (cell_name, cell_group) pair concurrently and merge the per-cell rules."""
+    cell_rules = {}
+    failed = {}
+
+    with mlflow.start_run(run_name="refine_rules_per_cell") as parent_run:
+        mlflow.log_params({"cell_count": len(cells), "max_workers": max_workers, "max_iteration": max_iteration})
+        log_prompt_templates(mlflow.log_params, mlflow.log_metrics)
+
+        # request_internal_llm 為同步呼叫，以 thread pool 控制同時進行的 cell 數量
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    refine_rules,
+                    cell_group,
+                    max_iteration=max_iteration,
+                    convergence_threshold=convergence_threshold,
+                    tracking=tracking,
+                    run_name=f"cell_{cell_name}",
+                    parent_run_id=parent_run.info.run_id,
+                ): cell_name
+                for cell_name, cell_group in cells
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                cell_name = futures[future]
+                try:
+                    cell_rules[cell_name] = future.result()
+                    print(f"[{done}/{len(cells)}] cell {cell_name} done")
+                except Exception as e:
+                    # 單一 cell 失敗不影響其他 cell
+                    failed[cell_name] = str(e)
+                    print(f"[{done}/{len(cells)}] cell {cell_name} failed: {e}")
+
+        # 依原本 cell 順序合併並去除重複的規則
+        merged_rules = merge_rule_sets(cell_rules[name] for name, _ in cells if name in cell_rules)
+        mlflow.log_metrics({"cells_succeeded": len(cell_rules), "cells_failed": len(failed)})
+        # 跨 cell 的整體命中率（相似 cell 之間的命中都在這裡）
+        if SEMANTIC_CACHE is not None:
+            log_semantic_cache(mlflow.log_params, mlflow.log_metrics, SEMANTIC_CACHE.stats())
+        if failed:
+            mlflow.log_dict(failed, artifact_file="failed_cells.json")
+        mlflow.log_text(merged_rules, artifact_file="final_rules.txt")
+
+    return merged_rules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate consistency rules from a Liberty file.")
+    parser.add_argument("lib_file", nargs="?", default="test.lib")
+    parser.add_argument("--max-iteration", type=int, default=2)
+    parser.add_argument("--convergence-threshold", type=float, default=0.9,
+                        help="Stop once consecutive rule sets overlap at least this much (0-1)")
+    parser.add_argument("--per-cell", action="store_true", help="Refine rules for each cell concurrently")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--tracking", choices=("buffered", "sync"), default="buffered",
+                        help="Upload MLflow params/metrics/artifacts in the background (buffered) or inline (sync)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Send only rule-relevant pin/pg_pin attributes instead of the raw Liberty dump")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Max estimated prompt tokens for the library context (with --compact)")
+    parser.add_argument("--index", action="store_true",
+                        help="Use the cached, memory-mapped parse index (implies --compact)")
+    parser.add_argument("--cache-dir", default=".liberty_cache")
+    parser.add_argument("--prompt-version", action="append", default=[], metavar="NAME=VERSION",
+                        help="Use a specific prompt template version, e.g. evaluate_rules=v2 (repeatable)")
+    parser.add_argument("--langchain-autolog", action="store_true",
+                        default=os.getenv("MLFLOW_LANGCHAIN_AUTOLOG", "0") == "1",
+                        help="Enable mlflow.langchain.autolog() (imports LangChain at startup)")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        default=os.getenv("SEMANTIC_CACHE", "0") == "1",
+                        help="Reuse answers of near-duplicate prompts (e.g. similar cells)")
+    parser.add_argument("--semantic-cache-threshold", type=float,
+                        default=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97")),
+                        help="Minimum cosine similarity for a semantic cache hit")
+    parser.add_argument("--semantic-cache-size", type=int, default=int(os.getenv("SEMANTIC_CACHE_SIZE", "512")))
+    parser.add_argument("--semantic-cache-embedder", default=os.getenv("SEMANTIC_CACHE_EMBEDDER", "ngram"),
+                        help="'ngram' (hashed n-grams, NumPy only) or 'st:<model>' (sentence-transformers)")
+    args = parser.parse_args()
+    setup_tracking(langchain_autolog=args.langchain_autolog)
+    if args.semantic_cache:
+        from semantic_cache import SemanticCache, make_embedder
+
+        SEMANTIC_CACHE = SemanticCache(
+            make_embedder(args.semantic_cache_embedder),
+            threshold=args.semantic_cache_threshold,
+            max_entries=args.semantic_cache_size,
+        )
+    for selection in args.prompt_version:
+        name, _, version = selection.partition("=")
+        PROMPTS.select(name, version)
+    refine_kwargs = {
+        "max_iteration": args.max_iteration,
+        "convergence_threshold": args.convergence_threshold,
+        "tracking": args.tracking,
+    }
 
-### 🔹 Run the iterative refinement process (2 iterations) with MLflow tracking
-final_rules = refine_rules(cell_group, max_iteration=2)
+    ### 🔹 Run the iterative refinement process with MLflow tracking
+    if args.index:
+        # 使用快取的 parse index：之後的執行完全跳過解析，cell 只在用到時才從 mmap 解碼
+        with load_or_build(args.lib_file, cache_dir=args.cache_dir) as lib_index:
+            if args.per_cell:
+                cells = [(cell["name"], format_cell(cell)) for cell in lib_index]
+                final_rules = refine_rules_per_cell(cells, **refine_kwargs, max_workers=args.max_workers)
+            else:
+                compact_lib = serialize_library(
+                    lib_index, token_budget=args.token_budget, raw_tokens=lib_index.raw_tokens
+                )
+                final_rules = refine_rules(compact_lib.text, **refine_kwargs, prompt_stats=compact_lib.report())
+    else:
+        ### 🔹 Read and parse the .lib file
+        with open(args.lib_file,"r") as f:
+            lib_content = f.read()
+        parsed_lib = parse_liberty(lib_content)
 
-### 🔹 Print final output
-print("\nFinal Refined Rules:\n", final_rules)
+        if args.per_cell:
+            final_rules = refine_rules_per_cell(
+                split_cells(parsed_lib, compact=args.compact), **refine_kwargs, max_workers=args.max_workers
+            )
+        elif args.compact:
+            compact_lib = serialize_library(
+                parsed_lib.get_groups("cell"),
+                token_budget=args.token_budget,
+                raw_tokens=estimate_tokens(str(parsed_lib)),
+            )
+            print(f"Compact library context: {compact_lib.tokens} tokens "
+                  f"(saved {compact_lib.tokens_saved} of {compact_lib.raw_tokens})")
+            final_rules = refine_rules(compact_lib.text, **refine_kwargs, prompt_stats=compact_lib.report())
+        else:
+            cell_group = str(parsed_lib)
+            final_rules = refine_rules(cell_group, **refine_kwargs)
 
+    ### 🔹 Print final output
+    print("\nFinal Refined Rules:\n", final_rules)
@@ -0,0 +1,175 @@
+"""
+Persistent, memory-mapped index of the rule-relevant parts of a Liberty file.
+
+第一次讀取某個 .lib 時會解析並寫入快取目錄（以檔案 sha256 與索引格式版本為 key）：
+    <cache_dir>/<sha256>.v<N>/cells.bin   每個 cell 的 JSON（extract_cell 的結果）依序串接
+    <cache_dir>/<sha256>.v<N>/index.json  cell 名稱 → (offset, length)、來源資訊，
+                                          以及未過濾的 cell 原文估計 token 數（raw_tokens）
+之後的執行直接 mmap cells.bin，只有實際用到的 cell 才會被解碼。
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+from liberty.parser import parse_liberty
+
+from liberty_prompt import estimate_tokens, extract_cell
+
+DEFAULT_CACHE_DIR = ".liberty_cache"
+# index.json 的欄位變更時遞增，舊格式的索引會以新的目錄重新建立
+INDEX_FORMAT = 2
+CELL_START = re.compile(r"^\s*cell\s*\(")
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash a file in fixed-size chunks so large libraries are never fully loaded."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_cell_blocks(path):
+    """
+    Yield the raw text of each top-level cell group, reading the file line by line.
+
+    只追蹤大括號深度（略過字串與 /* */ 註解中的括號），同一時間只保留一個 cell 的文字，
+    讓第一次解析的記憶體用量與最大的 cell 大小成正比，而不是整個檔案。
+    """
+    depth = 0
+    in_comment = False
+    block = None
+    block_depth = 0
+    with open(path, "r") as f:
+        for line in f:
+            if block is None and depth == 1 and not in_comment and CELL_START.match(line):
+                block = []
+                block_depth = depth
+            if block is not None:
+                block.append(line)
+
+            in_string = False
+            i = 0
+            while i < len(line):
+                two = line[i:i + 2]
+                if in_comment:
+                    if two == "*/":
+                        in_comment = False
+                        i += 1
+                elif in_string:
+                    if line[i] == "\\":
+                        i += 1
+                    elif line[i] == '"':
+                        in_string = False
+                elif two == "/*":
+                    in_comment = True
+                    i += 1
+                elif line[i] == '"':
+                    in_string = True
+                elif line[i] == "{":
+                    depth += 1
+                elif line[i] == "}":
+                    depth -= 1
+                i += 1
+
+            if block is not None and depth == block_depth and "}" in line:
+                yield "".join(block)
+                block = None
+
+
+def _parse_cells_streaming(path, stats):
+    for block in iter_cell_blocks(path):
+        stats["raw_tokens"] += estimate_tokens(block)
+        # 以最小的 library 包裝單一 cell 後再交給 liberty parser
+        wrapper = parse_liberty("library(__stream__) {\n" + block + "\n}")
+        for cell in wrapper.get_groups("cell"):
+            yield extract_cell(cell)
+
+
+def _parse_cells_full(path, stats):
+    with open(path, "r") as f:
+        library = parse_liberty(f.read())
+    for cell in library.get_groups("cell"):
+        stats["raw_tokens"] += estimate_tokens(str(cell))
+        yield extract_cell(cell)
+
+
+def build_index(lib_path, index_dir, streaming=True):
+    """Parse lib_path and write cells.bin / index.json into index_dir atomically."""
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".building-")
+    offsets = {}
+    # 未過濾的 cell 原文大小，供 serialize_library 計算精簡後省下的 token 數
+    stats = {"raw_tokens": 0}
+    try:
+        with open(os.path.join(tmp_dir, "cells.bin"), "wb") as data:
+            cells = _parse_cells_streaming(lib_path, stats) if streaming else _parse_cells_full(lib_path, stats)
+            for cell in cells:
+                encoded = json.dumps(cell, separators=(",", ":")).encode("utf-8")
+                offsets[cell["name"]] = (data.tell(), len(encoded))
+                data.write(encoded)
+        with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+            json.dump({"source": os.path.abspath(lib_path), "raw_tokens": stats["raw_tokens"], "cells": offsets}, f)
+        try:
+            os.rename(tmp_dir, index_dir)
+        except OSError:
+            # 其他程序已經先建好同一份索引
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return index_dir
+
+
+class LibertyIndex:
+    """Read-only view over a built index; cells are decoded lazily from the mmap."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "index.json")) as f:
+            meta = json.load(f)
+        self.source = meta["source"]
+        self.raw_tokens = meta.get("raw_tokens")
+        self._offsets = meta["cells"]
+        self._file = open(os.path.join(index_dir, "cells.bin"), "rb")
+        # 空的 library 無法 mmap 長度 0 的檔案
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets else b""
+
+    def cell_names(self):
+        return list(self._offsets)
+
+    def cell(self, name):
+        """Return the extract_cell dict (name, attributes, pg_pins, pins) of one cell."""
+        offset, length = self._offsets[name]
+        return json.loads(self._data[offset:offset + length])
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for name in self._offsets:
+            yield self.cell(name)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_or_build(lib_path, cache_dir=DEFAULT_CACHE_DIR, streaming=True):
+    """Open the cached index for lib_path, parsing and caching it first if needed."""
+    index_dir = os.path.join(cache_dir, f"{file_sha256(lib_path)}.v{INDEX_FORMAT}")
+    if not os.path.exists(os.path.join(index_dir, "index.json")):
+        build_index(lib_path, index_dir, streaming=streaming)
+    return LibertyIndex(index_dir)
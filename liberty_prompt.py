@@ -0,0 +1,147 @@
+import math
+from dataclasses import dataclass
+
+# 只保留與一致性規則相關的屬性，timing / power 等查表資料全部略過；
+# 清單需涵蓋 prompt_templates 中規則用到的屬性（例如 pg_pin 的 switch_function 與 switch_pin）
+CELL_ATTRIBUTES = (
+    "is_isolation_cell",
+    "is_level_shifter",
+    "level_shifter_type",
+    "switch_cell_type",
+    "retention_cell",
+    "always_on",
+    "dont_use",
+)
+PG_PIN_ATTRIBUTES = (
+    "pg_type",
+    "voltage_name",
+    "direction",
+    "user_pg_type",
+    "switch_function",
+    "switch_pin",
+    "pg_function",
+    "related_bias_pin",
+)
+PIN_ATTRIBUTES = (
+    "direction",
+    "related_power_pin",
+    "related_ground_pin",
+    "related_bias_pin",
+    "isolated",
+    "isolated_enable",
+    "isolation_cell_enable_pin",
+    "isolation_cell_data_pin",
+    "switch_function",
+    "switch_pin",
+    "pg_function",
+    "always_on",
+    "level_shifter_enable_pin",
+    "level_shifter_data_pin",
+    "retention_pin",
+)
+PIN_GROUPS = ("pin", "bus", "bundle")
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for Liberty/English text)."""
+    return math.ceil(len(text) / 4)
+
+
+def _group_name(group):
+    return str(group.args[0]).strip('"') if group.args else ""
+
+
+def _attributes(group, keep):
+    """Return the kept attributes of a Liberty group as {name: value}."""
+    attrs = group.attributes
+    items = attrs.items() if isinstance(attrs, dict) else ((attr.name, attr.value) for attr in attrs)
+    return {name: str(value).strip('"') for name, value in items if name in keep}
+
+
+def extract_cell(cell):
+    """Reduce a parsed Liberty cell group to its rule-relevant attributes."""
+    extracted = {
+        "name": _group_name(cell),
+        "attributes": _attributes(cell, CELL_ATTRIBUTES),
+        "pg_pins": {},
+        "pins": {},
+    }
+    for group in cell.groups:
+        if group.group_name == "pg_pin":
+            extracted["pg_pins"][_group_name(group)] = _attributes(group, PG_PIN_ATTRIBUTES)
+        elif group.group_name in PIN_GROUPS:
+            extracted["pins"][_group_name(group)] = _attributes(group, PIN_ATTRIBUTES)
+            # bus / bundle 底下的 pin 也要一併展開
+            for sub in group.groups:
+                if sub.group_name == "pin":
+                    extracted["pins"][_group_name(sub)] = _attributes(sub, PIN_ATTRIBUTES)
+    return extracted
+
+
+def _format_attributes(attrs):
+    return ", ".join(f"{name}={value}" for name, value in attrs.items())
+
+
+def format_cell(cell):
+    """Render an extracted cell dict as a compact, line-oriented prompt block."""
+    lines = [f"cell {cell['name']}" + (f": {_format_attributes(cell['attributes'])}" if cell["attributes"] else "")]
+    for name, attrs in cell["pg_pins"].items():
+        lines.append(f"  pg_pin {name}: {_format_attributes(attrs)}")
+    for name, attrs in cell["pins"].items():
+        lines.append(f"  pin {name}: {_format_attributes(attrs)}")
+    return "\n".join(lines)
+
+
+@dataclass
+class CompactLibrary:
+    text: str
+    tokens: int
+    raw_tokens: int
+    cells_included: int
+    cells_total: int
+
+    @property
+    def tokens_saved(self):
+        return max(self.raw_tokens - self.tokens, 0)
+
+    def report(self):
+        return {
+            "prompt_tokens_compact": self.tokens,
+            "prompt_tokens_raw": self.raw_tokens,
+            "prompt_tokens_saved": self.tokens_saved,
+            "prompt_cells_included": self.cells_included,
+            "prompt_cells_total": self.cells_total,
+        }
+
+
+def serialize_library(cells, token_budget=None, raw_tokens=None):
+    """
+    Serialize cells (parsed groups or extract_cell dicts) into a compact prompt.
+
+    Cells are added in order until token_budget is reached; the remaining cells are
+    summarized in a single trailing line. raw_tokens is the size of the unfiltered
+    dump and is only used for the savings report.
+    """
+    cells = [cell if isinstance(cell, dict) else extract_cell(cell) for cell in cells]
+    blocks = []
+    used = 0
+    for cell in cells:
+        block = format_cell(cell)
+        block_tokens = estimate_tokens(block) + 1
+        if token_budget is not None and blocks and used + block_tokens > token_budget:
+            break
+        blocks.append(block)
+        used += block_tokens
+
+    omitted = len(cells) - len(blocks)
+    if omitted:
+        blocks.append(f"... {omitted} more cells omitted to fit the token budget")
+    text = "\n".join(blocks)
+    tokens = estimate_tokens(text)
+    return CompactLibrary(
+        text=text,
+        tokens=tokens,
+        raw_tokens=raw_tokens if raw_tokens is not None else tokens,
+        cells_included=len(cells) - omitted,
+        cells_total=len(cells),
+    )
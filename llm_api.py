@@ -1,20 +1,130 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, Query
-from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+import math
+import os
+import time
+from typing import Optional, Union
+
+from fastapi import FastAPI, Request, Response, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-import requests
-import json
+import httpx
+
+from llm_quota import (
+    FairQueue, KeyQuota, KeyStore, QuotaExceededError, QuotaManager, UnknownKeyError, estimate_tokens,
+)
+from llm_scheduler import MicroBatchScheduler, QueueFullError
+from ml_mlflow_provider.metrics import REGISTRY, THROUGHPUT_BUCKETS, start_mlflow_emitter
+from ml_mlflow_provider.ndjson import ChatChunkEncoder, iter_ndjson, ollama_usage
+
+# Ollama 伺服器 URL（/api/chat：messages 原樣轉送，由模型的 chat template 組 prompt）
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+# 請求未指定 keep_alive 時的預設值（例如 "30m"、"-1" 表示常駐），未設定則沿用 Ollama 的預設
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE")
+
+# 上游連線池與逾時設定（單位：秒），可由環境變數調整
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# 生成過程中兩個 token 之間可能間隔很久，read timeout 需放寬
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+
+# Micro-batching 排程器（選用），LLM_SCHEDULER_ENABLED=1 時啟用
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "0") == "1"
+LLM_SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("LLM_SCHEDULER_MAX_BATCH_SIZE", "8"))
+LLM_SCHEDULER_MAX_WAIT_MS = float(os.getenv("LLM_SCHEDULER_MAX_WAIT_MS", "10"))
+LLM_SCHEDULER_MAX_CONCURRENCY = int(os.getenv("LLM_SCHEDULER_MAX_CONCURRENCY", "4"))
+LLM_SCHEDULER_MAX_QUEUE_SIZE = int(os.getenv("LLM_SCHEDULER_MAX_QUEUE_SIZE", "64"))
+
+# API key 與配額：LLM_API_KEYS_FILE 為 JSON 檔（修改後自動重新載入），否則使用 LLM_API_KEYS 的逗號分隔清單
+LLM_API_KEYS_FILE = os.getenv("LLM_API_KEYS_FILE")
+LLM_API_KEYS = os.getenv("LLM_API_KEYS", "kelly")
+# 每個 key 的預設配額（0 表示不限制）：每秒請求數、瞬間突發數與每分鐘 token 數（prompt 估計 + max_tokens）
+LLM_QUOTA_RPS = float(os.getenv("LLM_QUOTA_RPS", "0"))
+LLM_QUOTA_BURST = int(os.getenv("LLM_QUOTA_BURST", "1"))
+LLM_QUOTA_TPM = int(os.getenv("LLM_QUOTA_TPM", "0"))
+# 同時送往 Ollama 的請求上限，額滿時各 key 輪流放行；預設 0 表示不限制（只受 OLLAMA_MAX_CONNECTIONS 限制）
+LLM_FAIR_QUEUE_CONCURRENCY = int(os.getenv("LLM_FAIR_QUEUE_CONCURRENCY", "0"))
 
-app = FastAPI()
+# 延遲與吞吐量指標，於 /metrics 以 Prometheus 格式提供；LLM_METRICS_ENABLED=0 可關閉
+LLM_METRICS_ENABLED = os.getenv("LLM_METRICS_ENABLED", "1") == "1"
+# 設定後每 LLM_METRICS_MLFLOW_INTERVAL 秒將指標摘要記錄到此 MLflow experiment
+LLM_METRICS_MLFLOW_EXPERIMENT = os.getenv("LLM_METRICS_MLFLOW_EXPERIMENT")
+LLM_METRICS_MLFLOW_INTERVAL = float(os.getenv("LLM_METRICS_MLFLOW_INTERVAL", "60"))
+
+REGISTRY.enabled = LLM_METRICS_ENABLED
+REQUESTS_TOTAL = REGISTRY.counter("llm_api_requests_total", "Chat requests by outcome")
+QUEUE_SECONDS = REGISTRY.histogram("llm_api_queue_seconds", "Time spent waiting in the scheduler queue")
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram(
+    "llm_api_upstream_ttfb_seconds", "Time from sending to Ollama until the first chunk arrives"
+)
+UPSTREAM_SECONDS = REGISTRY.histogram("llm_api_upstream_seconds", "Total time of Ollama generations")
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "llm_api_tokens_per_second", "Ollama generation speed (eval_count / eval_duration)", THROUGHPUT_BUCKETS
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """啟動時建立共用、具連線池的 async HTTP client，關閉時釋放"""
+    app.state.http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(
+            OLLAMA_READ_TIMEOUT,
+            connect=OLLAMA_CONNECT_TIMEOUT,
+        ),
+    )
+    app.state.fair_queue = FairQueue(LLM_FAIR_QUEUE_CONCURRENCY) if LLM_FAIR_QUEUE_CONCURRENCY > 0 else None
+    app.state.scheduler = None
+    if LLM_SCHEDULER_ENABLED:
+        client = app.state.http_client
+
+        async def ollama_backend(payload, headers):
+            # 從派送出去的時間點開始計算上游耗時，排隊時間另由 on_dispatch 記錄
+            started = time.perf_counter()
+            response = await open_ollama_stream(client, payload, headers)
+            chunks = iter_ollama_chunks(response)
+            if REGISTRY.enabled:
+                chunks = instrument_chunks(chunks, started)
+            async for data in chunks:
+                yield data
+
+        app.state.scheduler = MicroBatchScheduler(
+            ollama_backend,
+            max_batch_size=LLM_SCHEDULER_MAX_BATCH_SIZE,
+            max_wait_ms=LLM_SCHEDULER_MAX_WAIT_MS,
+            max_concurrency=LLM_SCHEDULER_MAX_CONCURRENCY,
+            max_queue_size=LLM_SCHEDULER_MAX_QUEUE_SIZE,
+            on_dispatch=QUEUE_SECONDS.observe,
+        )
+        await app.state.scheduler.start()
+    if LLM_METRICS_ENABLED and LLM_METRICS_MLFLOW_EXPERIMENT:
+        start_mlflow_emitter(REGISTRY, LLM_METRICS_MLFLOW_EXPERIMENT, LLM_METRICS_MLFLOW_INTERVAL, run_name="llm_api")
+    try:
+        yield
+    finally:
+        if app.state.scheduler is not None:
+            await app.state.scheduler.stop()
+        await app.state.http_client.aclose()
 
-# Ollama 伺服器 URL
-OLLAMA_URL = "http://localhost:11434/api/generate"
 
-# 設定有效 API Keys（可擴充成從環境變數或資料庫讀取）
-VALID_API_KEYS = {"kelly"}
+app = FastAPI(lifespan=lifespan)
+
+# 有效的 API Keys 與各自的配額
+QUOTAS = QuotaManager(
+    KeyStore(
+        path=LLM_API_KEYS_FILE,
+        env_keys=LLM_API_KEYS,
+        default_quota=KeyQuota(LLM_QUOTA_RPS, LLM_QUOTA_BURST, LLM_QUOTA_TPM),
+    )
+)
 
 def verify_api_key(api_key: str = Query(..., description="API Key for authentication")):
     """檢查 API Key 是否有效"""
-    if api_key not in VALID_API_KEYS:
+    if not QUOTAS.is_valid(api_key):
         raise HTTPException(status_code=401, detail="Invalid API Key")
     return api_key
 
@@ -28,45 +138,229 @@ class ChatRequest(BaseModel):
     max_tokens: int = 2000
     n: int = 1
     seed: int = 0
+    stop: Optional[list[str]] = None
+    stream: bool = False  # True 時以 NDJSON 逐 token 回傳
+    # 模型在 Ollama 中常駐的時間；模型與 KV cache 保留時，多輪對話只需處理新增的訊息
+    keep_alive: Optional[Union[str, int]] = None
 
-@app.post("/chat")
-async def chat(request: ChatRequest, api_key: str = Depends(verify_api_key)):
+
+async def open_ollama_stream(client: httpx.AsyncClient, payload: dict, headers: dict) -> httpx.Response:
+    """送出串流請求到 Ollama，上游回傳錯誤狀態碼時直接轉成 HTTPException"""
+    upstream = client.build_request("POST", OLLAMA_URL, json=payload, headers=headers)
+    response = await client.send(upstream, stream=True)
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response
+
+
+async def iter_ollama_chunks(response: httpx.Response):
+    """直接在收到的 bytes 上逐行解析 Ollama 的 NDJSON 回應，結束或中斷時歸還連線"""
     try:
-        # 轉換 messages 格式為 Ollama 需要的 prompt
-        prompt = "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in request.messages)
+        async for data in iter_ndjson(response.aiter_bytes()):
+            yield data
+    finally:
+        await response.aclose()
 
-        headers = {
-            "X_AI_GN_TOKEN": f"Bearer {api_key}",
-            "X_UID": "TESTUSE",
-            "Content-Type": "application/json",
-        }
 
-        payload = {
-            "model": request.model,
-            "prompt": prompt,
-            "stream": True,  # 啟用 Streaming
-            "options": {
-                "temperature": request.temperature,
-                "top_p": request.top_p,
-                "frequency_penalty": request.frequency_penalty,
-                "presence_penalty": request.presence_penalty,
-                "max_tokens": request.max_tokens,
-                "seed": request.seed
-            }
+async def wait_first_chunk(chunks):
+    """
+    等到第一個 chunk（或錯誤）才回傳，之後原樣轉送。
+    經排程器時 submit() 在送出上游請求前就會回傳，先取得第一個 chunk，
+    上游錯誤才能在回應標頭送出前轉成對應的 HTTP 狀態碼，與不經排程器時一致。
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        return chunks
+
+    async def replay():
+        try:
+            yield first
+            async for data in chunks:
+                yield data
+        finally:
+            # 客戶端中斷時關閉上游串流（歸還連線、取消排程器中的請求）
+            await chunks.aclose()
+
+    return replay()
+
+
+async def instrument_chunks(chunks, started: float):
+    """記錄第一個 chunk 的到達時間、整體耗時與 Ollama 回報的生成速度，chunk 原樣轉送"""
+    first_chunk = True
+    async for data in chunks:
+        if first_chunk:
+            UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - started)
+            first_chunk = False
+        if data.get("done"):
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started)
+            if data.get("eval_count") and data.get("eval_duration"):
+                TOKENS_PER_SECOND.observe(data["eval_count"] / (data["eval_duration"] / 1e9))
+        yield data
+
+
+async def settle_after(chunks, api_key: str, charged_tokens: int, slot):
+    """轉送 chunk；結束時依 Ollama 回報的實際 token 數退回多扣的配額，並釋放公平佇列的名額"""
+    actual_tokens = None
+    try:
+        async for data in chunks:
+            if data.get("done"):
+                usage = ollama_usage(data)
+                if usage is not None:
+                    actual_tokens = usage["total_tokens"]
+            yield data
+    finally:
+        QUOTAS.settle(api_key, charged_tokens, actual_tokens)
+        if slot is not None:
+            slot.release()
+
+
+def chunk_content(data: dict) -> str:
+    """取出 /api/chat 串流 chunk 中本次新增的文字"""
+    return (data.get("message") or {}).get("content", "")
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus 文字格式的延遲與吞吐量指標"""
+    return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+async def start_generation(request: ChatRequest, app: FastAPI, api_key: str):
+    """組出 Ollama /api/chat 的 payload 並送出（直接或經排程器），回傳逐 chunk 的 async iterator"""
+    headers = {
+        "X_AI_GN_TOKEN": f"Bearer {api_key}",
+        "X_UID": "TESTUSE",
+        "Content-Type": "application/json",
+    }
+
+    # messages 原樣交給 /api/chat，多輪對話的前綴保持一致，Ollama 可重用已處理過的部分
+    payload = {
+        "model": request.model,
+        "messages": request.messages,
+        "stream": True,  # 啟用 Streaming
+        "options": {
+            "temperature": request.temperature,
+            "top_p": request.top_p,
+            "frequency_penalty": request.frequency_penalty,
+            "presence_penalty": request.presence_penalty,
+            "num_predict": request.max_tokens,  # Ollama 以 num_predict 限制生成長度
+            "seed": request.seed
         }
+    }
+    if request.stop:
+        payload["options"]["stop"] = request.stop
+    keep_alive = request.keep_alive if request.keep_alive is not None else OLLAMA_KEEP_ALIVE
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
 
-        # 發送請求到 Ollama，攜帶 Headers
-        response = requests.post(OLLAMA_URL, json=payload, headers=headers, stream=True)
+    scheduler: MicroBatchScheduler = app.state.scheduler
+    if scheduler is not None:
+        # 交給排程器分組派送，佇列已滿時回 429 讓客戶端稍後重試
+        try:
+            return await scheduler.submit(payload, headers)
+        except QueueFullError as e:
+            REQUESTS_TOTAL.inc(status="rejected")
+            raise HTTPException(
+                status_code=429,
+                detail=str(e),
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
 
-        # 逐行讀取 Ollama 回應，並流式傳回給客戶端
-        def event_stream():
-            for line in response.iter_lines():
-                if line:
-                    data = json.loads(line)
-                    if "response" in data:
-                        yield data["response"] + " "
+    # 透過共用 client 非同步發送請求到 Ollama，攜帶 Headers
+    client: httpx.AsyncClient = app.state.http_client
+    started = time.perf_counter()
+    response = await open_ollama_stream(client, payload, headers)
+    chunks = iter_ollama_chunks(response)
+    if REGISTRY.enabled:
+        chunks = instrument_chunks(chunks, started)
+    return chunks
 
-        return StreamingResponse(event_stream(), media_type="text/plain")
 
-    except requests.exceptions.RequestException as e:
+@app.post("/chat")
+async def chat(
+    request: ChatRequest, http_request: Request, response: Response, api_key: str = Depends(verify_api_key)
+):
+    # 依 prompt 長度與 max_tokens 預扣配額，不足時回 429 並附上剩餘配額與 Retry-After
+    try:
+        charged_tokens, quota_headers = QUOTAS.admit(api_key, estimate_tokens(request.messages, request.max_tokens))
+    except QuotaExceededError as e:
+        REQUESTS_TOTAL.inc(status="throttled")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={**e.headers, "Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except UnknownKeyError:
+        # key 在 verify_api_key 之後被重新載入的設定移除
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+
+    # 後端忙碌時依 key 輪流排隊，名額在回應結束後才釋放
+    fair_queue: FairQueue = http_request.app.state.fair_queue
+    slot = await fair_queue.acquire(api_key) if fair_queue is not None else None
+    try:
+        chunks = await wait_first_chunk(await start_generation(request, http_request.app, api_key))
+    except BaseException as e:
+        # 尚未開始生成就失敗（排程佇列已滿、上游錯誤等）：退回預扣的配額並釋放名額
+        QUOTAS.settle(api_key, charged_tokens, 0)
+        if slot is not None:
+            slot.release()
+        if isinstance(e, httpx.HTTPError):
+            raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
+        raise
+    chunks = settle_after(chunks, api_key, charged_tokens, slot)
+    REQUESTS_TOTAL.inc(status="accepted")
+
+    if request.stream:
+        # 逐 token 以 NDJSON 流式傳回給客戶端（格式比照 OpenAI chat.completion.chunk），
+        # 最後一行帶 finish_reason 與 Ollama 回報的 usage
+        encoder = ChatChunkEncoder(request.model)
+
+        async def event_stream():
+            async for data in chunks:
+                content = chunk_content(data)
+                if content:
+                    yield encoder.content(content)
+                if data.get("done"):
+                    yield encoder.final(data.get("done_reason", "stop"), ollama_usage(data))
+
+        # 客戶端在串流開始前就斷線時 event_stream 不會執行，由 background 確保名額釋放
+        return StreamingResponse(
+            event_stream(),
+            media_type="application/x-ndjson",
+            headers=quota_headers,
+            background=BackgroundTask(slot.release) if slot is not None else None,
+        )
+
+    try:
+        # 非串流模式：收齊所有片段後回傳單一 JSON，供 MLflow Gateway 的 send_request 解析
+        fragments = []
+        finish_reason = "stop"
+        usage = None
+        async for data in chunks:
+            content = chunk_content(data)
+            if content:
+                fragments.append(content)
+            if data.get("done"):
+                finish_reason = data.get("done_reason", "stop")
+                usage = ollama_usage(data)
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
+
+    response.headers.update(quota_headers)
+    result = {
+        "object": "chat.completion",
+        "model": request.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(fragments)},
+                "finish_reason": finish_reason,
+            }
+        ],
+    }
+    if usage is not None:
+        result["usage"] = usage
+    return result
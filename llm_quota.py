@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from typing import Optional
+
+_logger = logging.getLogger(__name__)
+
+
+class QuotaExceededError(Exception):
+    """API key 超過請求數或 token 配額，呼叫端應回傳 429 並帶上剩餘配額 headers"""
+
+    def __init__(self, limit: str, retry_after: float, headers: dict):
+        super().__init__(f"{limit} quota exceeded, retry after {retry_after:.0f}s")
+        self.limit = limit
+        self.retry_after = retry_after
+        self.headers = headers
+
+
+class UnknownKeyError(Exception):
+    """API key 不存在（例如在驗證之後被熱重新載入移除），呼叫端應回傳 401"""
+
+
+@dataclass
+class KeyQuota:
+    """單一 API key 的配額，0 表示不限制"""
+    requests_per_second: float = 0
+    burst: int = 1
+    tokens_per_minute: int = 0
+
+
+def estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    """以字元數粗估 prompt tokens（約 4 字元 1 token），再加上最多會生成的 max_tokens"""
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return prompt_chars // 4 + 1 + max(max_tokens, 0)
+
+
+class TokenBucket:
+    """非阻塞的 token bucket：每秒補充 rate，最多累積 capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reconfigure(self, rate: float, capacity: float):
+        """配額變更時保留目前剩餘量（不超過新上限）"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.level = min(self.level, capacity)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得 amount 需要等待的秒數，0 表示目前即可取得"""
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+    def seconds_until_full(self) -> float:
+        return (self.capacity - self.level) / self.rate if self.rate else 0.0
+
+
+class KeyStore:
+    """
+    API key 與配額的來源，支援兩種設定方式：
+      - path：JSON 檔 {"default": {...KeyQuota}, "keys": {"<key>": {...覆蓋 default 的欄位}}}，
+        檔案修改後會在 reload_interval 秒內自動重新載入，格式錯誤時保留舊設定
+      - env_keys：以逗號分隔的 key 清單，全部使用 default_quota
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        env_keys: str = "",
+        default_quota: Optional[KeyQuota] = None,
+        reload_interval: float = 1.0,
+    ):
+        self.path = path
+        self.default_quota = default_quota or KeyQuota()
+        self.reload_interval = reload_interval
+        self._env_keys = [key.strip() for key in env_keys.split(",") if key.strip()]
+        self._quotas: dict[str, KeyQuota] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._load()
+
+    def _parse_quota(self, base: KeyQuota, overrides: dict) -> KeyQuota:
+        names = {f.name for f in fields(KeyQuota)}
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(f"Unknown quota fields: {sorted(unknown)}")
+        return KeyQuota(**{**base.__dict__, **overrides})
+
+    def _load(self):
+        quotas = {key: self.default_quota for key in self._env_keys}
+        if self.path:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                default = self._parse_quota(self.default_quota, data.get("default", {}))
+                for key, overrides in data.get("keys", {}).items():
+                    quotas[key] = self._parse_quota(default, overrides or {})
+            except (OSError, ValueError, TypeError) as e:
+                if self._mtime is None and not self._quotas:
+                    raise
+                _logger.warning("Failed to reload API keys from %s, keeping previous keys: %s", self.path, e)
+                return False
+            self._mtime = mtime
+        self._quotas = quotas
+        return True
+
+    def _maybe_reload(self):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            # 先記下 mtime，格式錯誤的檔案不會每次都重新解析
+            self._mtime = mtime
+            if self._load():
+                _logger.info("Reloaded %d API keys from %s", len(self._quotas), self.path)
+
+    def get(self, api_key: str) -> Optional[KeyQuota]:
+        """回傳 key 的配額；不存在時回傳 None"""
+        self._maybe_reload()
+        return self._quotas.get(api_key)
+
+
+class QuotaManager:
+    """每個 API key 各有一個請求數與一個 token 數的 bucket，兩者都足夠時才放行"""
+
+    def __init__(self, store: KeyStore):
+        self.store = store
+        self._buckets: dict[str, tuple[KeyQuota, Optional[TokenBucket], Optional[TokenBucket]]] = {}
+
+    def _buckets_for(self, api_key: str, quota: KeyQuota):
+        entry = self._buckets.get(api_key)
+        if entry is not None and entry[0] == quota:
+            return entry[1], entry[2]
+
+        request_bucket = token_bucket = None
+        if quota.requests_per_second > 0:
+            capacity = max(quota.burst, 1)
+            if entry is not None and entry[1] is not None:
+                request_bucket = entry[1]
+                request_bucket.reconfigure(quota.requests_per_second, capacity)
+            else:
+                request_bucket = TokenBucket(quota.requests_per_second, capacity)
+        if quota.tokens_per_minute > 0:
+            if entry is not None and entry[2] is not None:
+                token_bucket = entry[2]
+                token_bucket.reconfigure(quota.tokens_per_minute / 60, quota.tokens_per_minute)
+            else:
+                token_bucket = TokenBucket(quota.tokens_per_minute / 60, quota.tokens_per_minute)
+        self._buckets[api_key] = (quota, request_bucket, token_bucket)
+        return request_bucket, token_bucket
+
+    @staticmethod
+    def _headers(quota: KeyQuota, request_bucket, token_bucket) -> dict:
+        headers = {}
+        if request_bucket is not None:
+            headers["X-RateLimit-Limit-Requests"] = str(max(quota.burst, 1))
+            headers["X-RateLimit-Remaining-Requests"] = str(max(int(request_bucket.level), 0))
+            headers["X-RateLimit-Reset-Requests"] = f"{request_bucket.seconds_until_full():.1f}s"
+        if token_bucket is not None:
+            headers["X-RateLimit-Limit-Tokens"] = str(quota.tokens_per_minute)
+            headers["X-RateLimit-Remaining-Tokens"] = str(max(int(token_bucket.level), 0))
+            headers["X-RateLimit-Reset-Tokens"] = f"{token_bucket.seconds_until_full():.1f}s"
+        return headers
+
+    def is_valid(self, api_key: str) -> bool:
+        return self.store.get(api_key) is not None
+
+    def admit(self, api_key: str, estimated_tokens: int) -> tuple[int, dict]:
+        """
+        扣除 1 個請求與 estimated_tokens 個 token，回傳 (實際扣除的 token 數, 剩餘配額 headers)；
+        任一配額不足時不扣除並拋出 QuotaExceededError；key 已不存在時拋出 UnknownKeyError。
+        單一請求的估計值超過每分鐘上限時，以上限計算（bucket 全滿時仍可通過）。
+        """
+        quota = self.store.get(api_key)
+        if quota is None:
+            raise UnknownKeyError(api_key)
+        request_bucket, token_bucket = self._buckets_for(api_key, quota)
+        cost = min(estimated_tokens, token_bucket.capacity) if token_bucket is not None else 0
+        now = time.monotonic()
+
+        request_wait = request_bucket.wait_time(1, now) if request_bucket is not None else 0.0
+        token_wait = token_bucket.wait_time(cost, now) if token_bucket is not None else 0.0
+        if request_wait or token_wait:
+            limit = "requests" if request_wait >= token_wait else "tokens"
+            raise QuotaExceededError(
+                limit, max(request_wait, token_wait), self._headers(quota, request_bucket, token_bucket)
+            )
+
+        if request_bucket is not None:
+            request_bucket.consume(1)
+        if token_bucket is not None:
+            token_bucket.consume(cost)
+        return cost, self._headers(quota, request_bucket, token_bucket)
+
+    def settle(self, api_key: str, charged_tokens: int, actual_tokens: Optional[int]):
+        """請求完成後依實際用量退回多扣的 token（估計值以 max_tokens 計，通常偏高）"""
+        entry = self._buckets.get(api_key)
+        if entry is None or entry[2] is None or actual_tokens is None:
+            return
+        if charged_tokens > actual_tokens:
+            entry[2].refund(charged_tokens - actual_tokens)
+
+
+class FairQueue:
+    """
+    限制同時送往後端的請求數；額滿時每個 API key 各自排隊，
+    有空位時依 key 輪流放行（round-robin），避免單一 key 的大量請求佔滿後端。
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._waiting: dict[str, deque] = {}
+        # 輪流順序：目前有請求在排隊的 key
+        self._turns: deque = deque()
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiting.values())
+
+    async def acquire(self, api_key: str) -> "FairSlot":
+        if self.in_flight < self.max_concurrency and not self._turns:
+            self.in_flight += 1
+            return FairSlot(self)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiting.get(api_key)
+        if queue is None:
+            queue = self._waiting[api_key] = deque()
+            self._turns.append(api_key)
+        queue.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名額但呼叫端被取消，把名額交給下一位
+                self._release()
+            elif future in queue:
+                queue.remove(future)
+                if not queue:
+                    del self._waiting[api_key]
+                    self._turns.remove(api_key)
+            raise
+        return FairSlot(self)
+
+    def _release(self):
+        self.in_flight -= 1
+        while self._turns and self.in_flight < self.max_concurrency:
+            api_key = self._turns.popleft()
+            queue = self._waiting[api_key]
+            future = queue.popleft()
+            if queue:
+                self._turns.append(api_key)
+            else:
+                del self._waiting[api_key]
+            if future.done():
+                # 等待中的請求已被取消，換下一位
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+
+class FairSlot:
+    """FairQueue 分配的名額，release() 可重複呼叫"""
+
+    def __init__(self, queue: FairQueue):
+        self._queue = queue
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._queue._release()
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Optional
+
+# 後端介面：輸入 Ollama payload 與 headers，回傳逐 chunk 的 async iterator（每個 chunk 為解析後的 dict）
+Backend = Callable[[dict, dict], AsyncIterator[dict]]
+
+_DONE = object()
+
+
+class QueueFullError(Exception):
+    """排程佇列已滿，呼叫端應回傳 429 並帶 Retry-After"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Scheduler queue is full, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Ticket:
+    payload: dict
+    headers: dict
+    enqueued_at: float = field(default_factory=time.monotonic)
+    chunks: asyncio.Queue = field(default_factory=asyncio.Queue)
+    task: Optional[asyncio.Task] = None
+    abandoned: bool = False
+
+    @property
+    def batch_key(self) -> str:
+        """同一 model 且相同 options 的請求視為可合併的一批"""
+        options = json.dumps(self.payload.get("options", {}), sort_keys=True)
+        return f"{self.payload.get('model')}|{options}"
+
+
+class MicroBatchScheduler:
+    """
+    在 llm_api 與 Ollama 之間的動態 micro-batching 排程器：
+      - 請求先進入有上限的佇列，佇列滿時 submit 會拋出 QueueFullError（背壓）
+      - 排程迴圈在 max_wait_ms 的視窗內最多收集 max_batch_size 筆請求，
+        依 model + options 分組後一起送出，讓後端同時處理同模型的請求
+      - 以 max_concurrency 限制同時送往後端的請求數，結果再分別送回各自的客戶端
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10,
+        max_concurrency: int = 4,
+        max_queue_size: int = 64,
+        on_dispatch: Optional[Callable[[float], None]] = None,
+    ):
+        self.backend = backend
+        # 請求從佇列派送出去時以排隊秒數呼叫，用於記錄 queue time
+        self.on_dispatch = on_dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        # 最近完成請求的平均耗時，用於估算 Retry-After
+        self._avg_latency = 1.0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._loop_task = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    def retry_after(self) -> float:
+        """依佇列長度、併發數與平均耗時估計需要等待的秒數"""
+        pending = self._queue.qsize() if self._queue is not None else 0
+        return max(1.0, pending / max(self.max_concurrency, 1) * self._avg_latency)
+
+    async def submit(self, payload: dict, headers: Optional[dict] = None) -> AsyncIterator[dict]:
+        """
+        將請求放入佇列並回傳該請求的 chunk 串流。
+        佇列已滿時立即拋出 QueueFullError，不會阻塞。
+        """
+        ticket = _Ticket(payload, headers or {})
+        try:
+            self._queue.put_nowait(ticket)
+        except asyncio.QueueFull:
+            raise QueueFullError(self.retry_after())
+        return self._drain(ticket)
+
+    async def _drain(self, ticket: _Ticket) -> AsyncIterator[dict]:
+        try:
+            while True:
+                item = await ticket.chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # 客戶端中斷時一併取消後端請求，釋放併發名額；尚未派送的請求直接略過
+            ticket.abandoned = True
+            if ticket.task is not None and not ticket.task.done():
+                ticket.task.cancel()
+
+    async def _collect_batch(self) -> list[_Ticket]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch_loop(self):
+        while True:
+            batch = await self._collect_batch()
+            groups: dict[str, list[_Ticket]] = {}
+            for ticket in batch:
+                groups.setdefault(ticket.batch_key, []).append(ticket)
+            # 同組請求連續送出，後端可在同一個已載入的模型上並行處理
+            for tickets in groups.values():
+                for ticket in tickets:
+                    if ticket.abandoned:
+                        continue
+                    await self._semaphore.acquire()
+                    ticket.task = asyncio.create_task(self._run(ticket))
+                    # 以 done callback 釋放名額，task 在開始執行前就被取消時也不會漏掉
+                    ticket.task.add_done_callback(lambda _: self._semaphore.release())
+
+    async def _run(self, ticket: _Ticket):
+        started = time.monotonic()
+        if self.on_dispatch is not None:
+            self.on_dispatch(started - ticket.enqueued_at)
+        try:
+            async for chunk in self.backend(ticket.payload, ticket.headers):
+                ticket.chunks.put_nowait(chunk)
+            ticket.chunks.put_nowait(_DONE)
+        except Exception as e:
+            ticket.chunks.put_nowait(e)
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * elapsed
+
+
+class FakeOllamaBackend:
+    """
+    測試用的假 Ollama 後端，不需 GPU 即可驗證排程行為。
+    依 token_latency_ms 逐字回傳 reply 的內容，格式與 /api/chat 的串流 chunk 相同，
+    並記錄同時在處理中的最大請求數與收到的 payload。
+    """
+
+    def __init__(self, reply: str = "Hello from fake backend", token_latency_ms: float = 5, fail: bool = False):
+        self.reply = reply
+        self.token_latency = token_latency_ms / 1000
+        self.fail = fail
+        self.calls: list[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, payload: dict, headers: Optional[dict] = None) -> AsyncIterator[dict]:
+        self.calls.append(payload)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.fail:
+                raise RuntimeError("fake backend failure")
+            for i, token in enumerate(self.reply.split(" ")):
+                await asyncio.sleep(self.token_latency)
+                text = token if i == 0 else " " + token
+                yield {"model": payload.get("model"), "message": {"role": "assistant", "content": text}, "done": False}
+            yield {
+                "model": payload.get("model"),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "stop",
+            }
+        finally:
+            self.in_flight -= 1
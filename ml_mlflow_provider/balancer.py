@@ -0,0 +1,159 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class NoHealthyBackendError(Exception):
+    """所有後端都已被排除（本次請求已試過或熔斷中）"""
+
+
+class BackendState:
+    """單一後端節點的即時狀態與累計統計"""
+
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        # 熔斷開啟的時間點，None 表示正常
+        self.ejected_at: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+
+    def is_available(self, now: float, recovery_seconds: float) -> bool:
+        """熔斷中的節點在 recovery_seconds 後重新開放（half-open），下一次成功即恢復"""
+        return self.ejected_at is None or now - self.ejected_at >= recovery_seconds
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "ewma_latency": self.ewma_latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": self.ejected_at is not None,
+        }
+
+
+class LoadBalancer:
+    """
+    多後端負載平衡：
+      - least_outstanding：選擇 (進行中請求數 + 1) / weight 最小的節點
+      - ewma：以延遲的指數移動平均乘上 (進行中請求數 + 1) / weight 評分，尚無延遲資料的節點優先試探
+      - 連續失敗 failure_threshold 次即熔斷剔除，recovery_seconds 後再放行試探
+    """
+
+    STRATEGIES = ("least_outstanding", "ewma")
+
+    def __init__(
+        self,
+        backends: Iterable[BackendState],
+        strategy: str = "least_outstanding",
+        max_retries: int = 1,
+        failure_threshold: int = 3,
+        recovery_seconds: float = 30,
+        ewma_alpha: float = 0.3,
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy {strategy!r}, expected one of {self.STRATEGIES}")
+        self.backends = list(backends)
+        self.strategy = strategy
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.ewma_alpha = ewma_alpha
+
+    def _score(self, backend: BackendState) -> float:
+        load = (backend.outstanding + 1) / backend.weight
+        if self.strategy == "ewma":
+            return (backend.ewma_latency or 0.0) * load
+        return load
+
+    def pick(self, exclude: Iterable[BackendState] = ()) -> BackendState:
+        excluded = {id(b) for b in exclude}
+        candidates = [b for b in self.backends if id(b) not in excluded]
+        if not candidates:
+            raise NoHealthyBackendError("All backends have already been tried for this request")
+
+        now = time.monotonic()
+        available = [b for b in candidates if b.is_available(now, self.recovery_seconds)]
+        if not available:
+            # 全部熔斷時不直接失敗，退而選擇最早被剔除的節點試探
+            return min(candidates, key=lambda b: b.ejected_at)
+
+        best = min(self._score(b) for b in available)
+        return random.choice([b for b in available if self._score(b) == best])
+
+    def record_success(self, backend: BackendState, latency: float) -> None:
+        if backend.ewma_latency is None:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * backend.ewma_latency
+        backend.consecutive_failures = 0
+        if backend.ejected_at is not None:
+            _logger.info("Backend %s recovered, returning it to the pool", backend.url)
+            backend.ejected_at = None
+
+    def record_failure(self, backend: BackendState) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.failure_threshold:
+            if backend.ejected_at is None:
+                _logger.warning(
+                    "Backend %s failed %d times in a row, ejecting it for %.0fs",
+                    backend.url,
+                    backend.consecutive_failures,
+                    self.recovery_seconds,
+                )
+            backend.ejected_at = time.monotonic()
+
+    @contextmanager
+    def track(self, backend: BackendState, is_failure: Callable[[Exception], bool] = lambda e: True):
+        """記錄一次請求的進行中數量與結果；is_failure 判斷例外是否應計入熔斷"""
+        backend.outstanding += 1
+        backend.requests += 1
+        started = time.monotonic()
+        try:
+            yield backend
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure(backend)
+            raise
+        else:
+            self.record_success(backend, time.monotonic() - started)
+        finally:
+            backend.outstanding -= 1
+
+    async def call(
+        self,
+        send: Callable[[str], Awaitable[T]],
+        is_retryable: Callable[[Exception], bool],
+        retry: bool = True,
+    ) -> T:
+        """
+        以 send(url) 呼叫選出的後端；遇到可重試的錯誤時換一個尚未試過的節點重送，
+        最多 max_retries 次。只有冪等的呼叫才應傳入 retry=True。
+        """
+        tried = []
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            backend = self.pick(exclude=tried)
+            tried.append(backend)
+            try:
+                with self.track(backend, is_failure=is_retryable):
+                    return await send(backend.url)
+            except Exception as e:
+                if attempt + 1 >= attempts or not is_retryable(e) or len(tried) >= len(self.backends):
+                    raise
+                _logger.warning("Request to %s failed (%s), retrying on another backend", backend.url, e)
+
+    def stats(self) -> list[dict]:
+        return [b.stats() for b in self.backends]
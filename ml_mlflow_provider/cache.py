@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    後端回應快取：
+      - 第一層為記憶體內 LRU + TTL，超過 max_entries 時淘汰最久未使用的項目
+      - 第二層（選用）為磁碟，每個 key 一個 JSON 檔，gateway 重啟後仍可命中
+      - get_or_fetch 提供 single-flight：相同 key 的並行請求只會打一次後端
+    磁碟讀寫以 asyncio.to_thread 執行，不會阻塞 gateway 的 event loop。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+
+    @staticmethod
+    def make_key(api_request: dict) -> str:
+        """以正規化（排序 key、去除空白）後的後端請求內容計算 cache key"""
+        normalized = json.dumps(api_request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _disk_file(self, key: str) -> str:
+        return os.path.join(self.disk_path, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> tuple[Optional[tuple[float, dict]], bool]:
+        """在 worker thread 中執行，回傳 (紀錄, 是否已過期)；計數器由 event loop 端更新"""
+        path = self._disk_file(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None, False
+        if record["expires_at"] <= time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, True
+        return (record["expires_at"], record["response"]), False
+
+    def _write_disk(self, key: str, expires_at: float, value: dict) -> None:
+        """在 worker thread 中執行"""
+        path = self._disk_file(key)
+        # 先寫暫存檔再 rename，避免其他 worker 讀到寫一半的檔案
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "response": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            _logger.warning("Failed to write response cache entry %s: %s", key, e)
+
+    def _store_memory(self, key: str, expires_at: float, value: dict) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return value
+            del self._entries[key]
+            self._counters["expirations"] += 1
+        return None
+
+    async def _get_disk(self, key: str) -> Optional[dict]:
+        if not self.disk_path:
+            return None
+        record, expired = await asyncio.to_thread(self._read_disk, key)
+        if expired:
+            self._counters["expirations"] += 1
+        if record is None:
+            return None
+        self._store_memory(key, *record)
+        self._counters["disk_hits"] += 1
+        return record[1]
+
+    async def get(self, key: str) -> Optional[dict]:
+        """依序查詢記憶體與磁碟，命中磁碟時回填記憶體；都沒有時計為 miss"""
+        value = self._get_memory(key)
+        if value is None:
+            value = await self._get_disk(key)
+        if value is None:
+            self._counters["misses"] += 1
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        self._store_memory(key, expires_at, value)
+        if self.disk_path:
+            await asyncio.to_thread(self._write_disk, key, expires_at, value)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        命中記憶體直接回傳；否則若已有相同 key 的請求在進行中，等待其結果（single-flight，只計為 coalesced），
+        都沒有時由這個請求查詢磁碟，仍未命中才呼叫 fetch 向後端取得回應並寫入快取。
+        """
+        cached = self._get_memory(key)
+        if cached is not None:
+            return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._counters["coalesced"] += 1
+            # shield：單一等待者被取消時不影響其他共用同一個結果的請求
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._get_disk(key)
+            if value is not None:
+                future.set_result(value)
+                return value
+            self._counters["misses"] += 1
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 沒有其他等待者時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            # 先回覆等待者，再於 thread 中寫入磁碟
+            expires_at = time.time() + self.ttl_seconds
+            self._store_memory(key, expires_at, value)
+            future.set_result(value)
+            if self.disk_path:
+                await asyncio.to_thread(self._write_disk, key, expires_at, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict[str, Any]:
+        """回傳命中 / 未命中 / 淘汰等統計，供調整 max_entries 與 ttl_seconds 參考"""
+        hits = self._counters["hits"] + self._counters["disk_hits"]
+        lookups = hits + self._counters["misses"] + self._counters["coalesced"]
+        return {
+            **self._counters,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            # 不需要送往後端的比例（快取命中 + 併入進行中的相同請求）
+            "backend_avoided_rate": (hits + self._counters["coalesced"]) / lookups if lookups else 0.0,
+        }
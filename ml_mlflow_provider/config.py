@@ -1,10 +1,82 @@
 import os
+from typing import Optional, Union
+
 from pydantic import validator
 from mlflow.gateway.base_models import ConfigModel
 
+
+class CacheConfig(ConfigModel):
+    """回應快取設定：記憶體 LRU/TTL 為第一層，disk_path 有設定時啟用磁碟第二層"""
+    enabled: bool = True
+    max_entries: int = 1024
+    ttl_seconds: float = 3600
+    disk_path: Optional[str] = None
+    # 每查詢幾次在 log 輸出一次命中率統計，0 表示不輸出
+    stats_log_interval: int = 100
+
+    @validator("disk_path", pre=True)
+    def validate_disk_path(cls, value):
+        if isinstance(value, str) and value.startswith("$"):
+            env_var_name = value[1:]
+            return os.getenv(env_var_name, value)
+        return value
+
+
+class MetricsConfig(ConfigModel):
+    """延遲與吞吐量指標：port 有設定時提供 Prometheus /metrics，mlflow_experiment 有設定時定期記錄到 MLflow"""
+    enabled: bool = True
+    port: Optional[int] = None
+    mlflow_experiment: Optional[str] = None
+    mlflow_interval: float = 60
+
+
+class BackendConfig(ConfigModel):
+    """單一後端節點，weight 越大分到的流量越多"""
+    url: str
+    weight: float = 1.0
+
+    @validator("url", pre=True)
+    def validate_url(cls, value):
+        if value.startswith("$"):
+            env_var_name = value[1:]
+            return os.getenv(env_var_name, value)
+        return value
+
+
+class LoadBalancingConfig(ConfigModel):
+    """多後端負載平衡與熔斷設定"""
+    strategy: str = "least_outstanding"  # least_outstanding 或 ewma
+    max_retries: int = 1
+    failure_threshold: int = 3
+    recovery_seconds: float = 30
+
+
+class HedgingConfig(ConfigModel):
+    """
+    Hedged requests：超過最近延遲（串流為第一個 chunk）的 percentile 百分位數仍未回應時，
+    再送一個相同請求到另一個後端（單一後端時即為重送），採用先完成者；
+    max_extra_load 限制 hedge 佔請求數的比例上限
+    """
+    enabled: bool = True
+    percentile: float = 95
+    min_delay_seconds: float = 0.5
+    # 樣本數不足 min_samples 前使用的固定延遲
+    initial_delay_seconds: float = 5.0
+    min_samples: int = 20
+    window: int = 200
+    max_extra_load: float = 0.1
+
+
 class CustomLLMConfig(ConfigModel):
     llm_api_key: str
-    api_url: str
+    # 可為單一 URL，或多個後端節點的清單（字串或 {url, weight}）
+    api_url: list[BackendConfig]
+    load_balancing: LoadBalancingConfig = LoadBalancingConfig()
+    cache: Optional[CacheConfig] = None
+    metrics: Optional[MetricsConfig] = None
+    hedging: Optional[HedgingConfig] = None
+    # 轉送給後端 Ollama 的 keep_alive（例如 "30m"），讓模型與對話的 KV cache 在輪次之間保持載入
+    keep_alive: Optional[Union[str, int]] = None
 
     @validator("llm_api_key", pre=True)
     def validate_llm_api_key(cls, value):
@@ -14,8 +86,8 @@ class CustomLLMConfig(ConfigModel):
         return value
 
     @validator("api_url", pre=True)
-    def validate_api_url(cls, value):
-        if value.startswith("$"):
-            env_var_name = value[1:]
-            return os.getenv(env_var_name, value)
-        return value
\ No newline at end of file
+    def validate_api_url(cls, value: Union[str, list]):
+        # 統一轉成節點清單，單一 URL 視為只有一個節點
+        if isinstance(value, (str, dict)):
+            value = [value]
+        return [{"url": item} if isinstance(item, str) else item for item in value]
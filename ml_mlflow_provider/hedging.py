@@ -0,0 +1,212 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from ml_mlflow_provider.metrics import REGISTRY
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+HEDGES_FIRED = REGISTRY.counter("custom_llm_hedges_fired_total", "Hedge requests sent after the hedge delay")
+HEDGES_WON = REGISTRY.counter("custom_llm_hedges_won_total", "Hedge requests that finished before the original")
+HEDGES_SKIPPED = REGISTRY.counter(
+    "custom_llm_hedges_skipped_total", "Hedges not sent because the extra load budget was exhausted"
+)
+
+
+class LatencyWindow:
+    """最近 size 筆延遲的滑動視窗，用於計算百分位數"""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+        self._sorted: list[float] = []
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value: float):
+        if len(self._samples) == self._samples.maxlen:
+            oldest = self._samples[0]
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+        self._samples.append(value)
+        bisect.insort(self._sorted, value)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._sorted:
+            return None
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * pct / 100))
+        return self._sorted[index]
+
+
+class HedgeBudget:
+    """
+    限制 hedge 造成的額外負載：每個請求累積 max_extra_load 點額度（最多 burst 點），
+    每送出一個 hedge 扣 1 點，長期下來 hedge 數不超過請求數的 max_extra_load 比例。
+    """
+
+    def __init__(self, max_extra_load: float = 0.1, burst: float = 10):
+        self.max_extra_load = max_extra_load
+        self.burst = burst
+        self.credits = 0.0
+
+    def record_request(self):
+        self.credits = min(self.burst, self.credits + self.max_extra_load)
+
+    def try_acquire(self) -> bool:
+        if self.credits >= 1:
+            self.credits -= 1
+            return True
+        return False
+
+
+class Hedger:
+    """
+    Hedged requests：原請求超過延遲的 percentile 百分位數仍未完成（或串流未收到第一個 chunk）時，
+    再送出一個相同的請求（由負載平衡選擇節點，通常是另一個後端），採用先完成者並取消另一個。
+    樣本數不足 min_samples 前使用 initial_delay。
+    """
+
+    def __init__(
+        self,
+        route: str,
+        budget: HedgeBudget,
+        percentile: float = 95,
+        min_delay: float = 0.5,
+        initial_delay: float = 5.0,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.route = route
+        self.budget = budget
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = LatencyWindow(window)
+        self.fired = 0
+        self.won = 0
+        self.skipped = 0
+
+    def delay(self) -> float:
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    def stats(self) -> dict:
+        return {"delay": self.delay(), "fired": self.fired, "won": self.won, "skipped": self.skipped}
+
+    def _try_fire(self) -> bool:
+        if self.budget.try_acquire():
+            self.fired += 1
+            HEDGES_FIRED.inc(route=self.route)
+            return True
+        self.skipped += 1
+        HEDGES_SKIPPED.inc(route=self.route)
+        return False
+
+    def _record_win(self, is_hedge: bool):
+        if is_hedge:
+            self.won += 1
+            HEDGES_WON.inc(route=self.route)
+
+    @staticmethod
+    async def _cancel(tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def call(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """以 attempt() 發出請求，逾 delay() 未完成時再發一次，回傳先成功的結果"""
+        self.budget.record_request()
+        started = {}
+        tasks = {}
+
+        def launch(is_hedge):
+            task = asyncio.ensure_future(attempt())
+            started[task] = time.monotonic()
+            tasks[task] = is_hedge
+            return task
+
+        launch(is_hedge=False)
+        hedge_pending = True
+        error = None
+        try:
+            while tasks:
+                timeout = self.delay() - (time.monotonic() - min(started.values())) if hedge_pending else None
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(timeout, 0) if timeout is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedge_pending = False
+                    if self._try_fire():
+                        launch(is_hedge=True)
+                    continue
+                for task in done:
+                    is_hedge = tasks.pop(task)
+                    if task.exception() is None:
+                        self.latencies.add(time.monotonic() - started[task])
+                        self._record_win(is_hedge)
+                        return task.result()
+                    # 一方失敗時等待另一方；原請求先失敗且尚未 hedge 時不再 hedge，直接拋出
+                    error = task.exception()
+            raise error
+        finally:
+            await self._cancel(list(tasks))
+
+    async def stream(self, open_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """串流版本：以第一個 chunk 的到達時間判斷，採用先收到 chunk 的串流並關閉另一個"""
+        self.budget.record_request()
+        streams = {}
+
+        def launch(is_hedge):
+            stream = open_stream()
+            task = asyncio.ensure_future(stream.__anext__())
+            streams[task] = (stream, is_hedge, time.monotonic())
+
+        launch(is_hedge=False)
+        hedge_pending = True
+        winner = None
+        error = None
+        try:
+            while streams and winner is None:
+                first_started = min(started for _, _, started in streams.values())
+                timeout = self.delay() - (time.monotonic() - first_started) if hedge_pending else None
+                done, _ = await asyncio.wait(
+                    streams, timeout=max(timeout, 0) if timeout is not None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedge_pending = False
+                    if self._try_fire():
+                        launch(is_hedge=True)
+                    continue
+                for task in done:
+                    stream, is_hedge, started = streams.pop(task)
+                    if task.exception() is None or isinstance(task.exception(), StopAsyncIteration):
+                        self.latencies.add(time.monotonic() - started)
+                        self._record_win(is_hedge)
+                        winner = (task, stream)
+                        break
+                    error = task.exception()
+            if winner is None:
+                raise error
+        finally:
+            # 關閉落後的串流：先取消等待中的 __anext__，再關閉 generator 釋放連線
+            await self._cancel(list(streams))
+            for stream, _, _ in streams.values():
+                await stream.aclose()
+
+        task, stream = winner
+        if task.exception() is not None:
+            return
+        try:
+            yield task.result()
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -0,0 +1,249 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Optional
+
+_logger = logging.getLogger(__name__)
+
+# 延遲類指標的預設 bucket（秒），涵蓋毫秒級的轉換到數分鐘的長生成
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+_NULL_TIMER = nullcontext()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _items(self) -> list:
+        # 事件迴圈 thread 可能同時新增 label 組合，先在 lock 內複製再走訪
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self) -> dict[str, float]:
+        return {f"{self.name}{_format_labels(key)}": value for key, value in self._items()}
+
+
+class Histogram:
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # 每組 label：[各 bucket 計數..., +Inf 計數], 總和, 次數
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def _time(self, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def time(self, **labels):
+        """以 with 量測一段程式的耗時；停用時回傳共用的空 context，幾乎沒有額外成本"""
+        if not self.registry.enabled:
+            return _NULL_TIMER
+        return self._time(labels)
+
+    def _items(self) -> list:
+        # 連同各 bucket 計數一起在 lock 內複製，輸出時不會與 observe() 互相干擾
+        with self._lock:
+            return [(key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def snapshot(self) -> dict[str, float]:
+        result = {}
+        for key, (_, total, count) in self._items():
+            labels = _format_labels(key)
+            result[f"{self.name}_count{labels}"] = count
+            result[f"{self.name}_mean{labels}"] = total / count if count else 0.0
+        return result
+
+
+class MetricsRegistry:
+    """
+    輕量的指標註冊表，輸出 Prometheus 文字格式；
+    enabled=False 時所有 observe / inc / time 都直接返回。
+    gauge 以 callback 在輸出時才計算（例如快取、後端節點的統計）。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: dict[str, object] = {}
+        self._gauges: dict[str, tuple[str, list[Callable[[], list]]]] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(self, name, help))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(self, name, help, buckets))
+
+    def gauge_callback(self, name: str, help: str, collect: Callable[[], list]):
+        """
+        collect() 回傳 [(labels dict, 數值), ...]，在輸出時才呼叫；
+        同名 gauge 可由多個來源（例如多個 route）各自註冊。
+        """
+        self._gauges.setdefault(name, (help, []))[1].append(collect)
+
+    def _collect_gauges(self):
+        for name, (help, collectors) in list(self._gauges.items()):
+            values = {}
+            for collect in collectors:
+                try:
+                    values.update((_label_key(labels), value) for labels, value in collect())
+                except Exception as e:
+                    _logger.debug("Gauge %s collection failed: %s", name, e)
+            yield name, help, values
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for name, help, values in self._collect_gauges():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict[str, float]:
+        """扁平化的數值摘要（次數、平均值、計數器與 gauge），用於記錄成 MLflow metrics"""
+        result = {}
+        for metric in list(self._metrics.values()):
+            result.update(metric.snapshot())
+        for name, _, values in self._collect_gauges():
+            for key, value in values.items():
+                result[f"{name}{_format_labels(key)}"] = value
+        return result
+
+
+# 同一個 process 內共用的預設註冊表，由 provider / llm_api 依設定開啟
+REGISTRY = MetricsRegistry(enabled=False)
+
+_http_servers: dict[int, object] = {}
+_mlflow_emitters: dict[str, str] = {}
+
+
+def start_http_server(registry: MetricsRegistry, port: int, host: str = "0.0.0.0"):
+    """在背景 thread 以 /metrics 提供 Prometheus 文字格式；同一個 port 只會啟動一次"""
+    if port in _http_servers:
+        return _http_servers[port]
+
+    # http.server 會連帶載入 email / socketserver 等模組，只在實際啟動時匯入
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name=f"metrics-http-{port}", daemon=True).start()
+    _http_servers[port] = server
+    return server
+
+
+def start_mlflow_emitter(registry: MetricsRegistry, experiment_name: str, interval: float = 60, run_name: str = None):
+    """每 interval 秒把 registry.snapshot() 記錄到指定 experiment 的同一個 MLflow run；同一個 experiment 只會啟動一次"""
+    if experiment_name in _mlflow_emitters:
+        return _mlflow_emitters[experiment_name]
+
+    import re
+
+    from mlflow.entities import Metric
+    from mlflow.tracking import MlflowClient
+
+    client = MlflowClient()
+    experiment = client.get_experiment_by_name(experiment_name)
+    experiment_id = experiment.experiment_id if experiment else client.create_experiment(experiment_name)
+    run_id = client.create_run(experiment_id, run_name=run_name).info.run_id
+
+    def emit():
+        step = 0
+        while True:
+            time.sleep(interval)
+            step += 1
+            timestamp = int(time.time() * 1000)
+            # snapshot 失敗也只略過這一輪，不能讓 emitter thread 結束
+            try:
+                # MLflow metric 名稱不允許 {}=" 等字元
+                metrics = [
+                    Metric(re.sub(r"[^\w\-./ ]", "_", name), float(value), timestamp, step)
+                    for name, value in registry.snapshot().items()
+                ]
+                for i in range(0, len(metrics), 1000):
+                    client.log_batch(run_id, metrics=metrics[i:i + 1000])
+            except Exception as e:
+                _logger.warning("Failed to emit metrics to MLflow run %s: %s", run_id, e)
+
+    threading.Thread(target=emit, name="metrics-mlflow-emitter", daemon=True).start()
+    _mlflow_emitters[experiment_name] = run_id
+    return run_id
@@ -0,0 +1,138 @@
+"""
+Incremental NDJSON parsing and encoding for the Ollama / llm_api streaming paths.
+
+直接在原始 bytes 上切行解析，不先解碼成 str、也不逐 chunk 串接字串；
+有安裝 orjson 時自動使用（解析與序列化都較快），否則退回標準庫 json。
+"""
+import json
+from typing import AsyncIterable, AsyncIterator, Optional
+
+try:
+    import orjson
+except ImportError:  # 選用的加速套件
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+# SSE 串流的結束標記 "data: [DONE]"
+DONE = object()
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class NDJSONDecoder:
+    """
+    增量 NDJSON 解析器：feed() 收到任意切割的 bytes，回傳其中完整的各行解析結果。
+    只有跨 chunk 的不完整行會暫存在緩衝區，其餘行直接從收到的 bytes 切出解析。
+    sse=True 時同時接受 SSE 的 "data: " 前綴，"[DONE]" 解析為 DONE。
+    """
+
+    def __init__(self, sse: bool = False):
+        self.sse = sse
+        self._pending = bytearray()
+
+    def _parse(self, line, objects: list):
+        # 略過空行與只有空白（含 \r）的行
+        if not line or line.isspace():
+            return
+        if self.sse:
+            if line.startswith(b"data:"):
+                line = line[5:]
+            if b"[DONE]" in line and line.strip() == b"[DONE]":
+                objects.append(DONE)
+                return
+        objects.append(loads(line))
+
+    def feed(self, data: bytes) -> list:
+        objects = []
+        start = 0
+        if self._pending:
+            end = data.find(b"\n")
+            if end < 0:
+                self._pending += data
+                return objects
+            self._pending += data[:end]
+            self._parse(bytes(self._pending), objects)
+            self._pending.clear()
+            start = end + 1
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            self._parse(data[start:end], objects)
+            start = end + 1
+        if start < len(data):
+            self._pending += data[start:]
+        return objects
+
+    def flush(self) -> list:
+        """串流結束時解析最後一行沒有換行結尾的資料"""
+        objects = []
+        if self._pending:
+            self._parse(bytes(self._pending), objects)
+            self._pending.clear()
+        return objects
+
+
+async def iter_ndjson(chunks: AsyncIterable[bytes], sse: bool = False) -> AsyncIterator:
+    """將 bytes 串流逐行解析成物件；sse=True 時遇到 "[DONE]" 即結束"""
+    decoder = NDJSONDecoder(sse=sse)
+    async for data in chunks:
+        for obj in decoder.feed(data):
+            if obj is DONE:
+                return
+            yield obj
+    for obj in decoder.flush():
+        if obj is DONE:
+            return
+        yield obj
+
+
+def ollama_usage(data: dict) -> Optional[dict]:
+    """Ollama 最後一個 chunk（done=true）的 token 統計轉成 OpenAI 格式的 usage；沒有統計時回傳 None"""
+    if "eval_count" not in data and "prompt_eval_count" not in data:
+        return None
+    prompt_tokens = int(data.get("prompt_eval_count") or 0)
+    completion_tokens = int(data.get("eval_count") or 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class ChatChunkEncoder:
+    """
+    組出 chat.completion.chunk 的 NDJSON 行（bytes）。
+    固定的前後段在建立時序列化一次，每個 token 只需編碼文字本身再接上前後段。
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self._prefix = b'{"object":"chat.completion.chunk","model":' + dumps(model) + (
+            b',"choices":[{"index":0,"delta":{"content":'
+        )
+        self._suffix = b'},"finish_reason":null}]}\n'
+
+    def content(self, text: str) -> bytes:
+        return b"".join((self._prefix, dumps(text), self._suffix))
+
+    def final(self, finish_reason: str, usage: Optional[dict] = None) -> bytes:
+        """最後一行：空的 delta、finish_reason 與（若有）usage"""
+        chunk = {
+            "object": "chat.completion.chunk",
+            "model": self.model,
+            "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": finish_reason}],
+        }
+        if usage is not None:
+            chunk["usage"] = usage
+        return dumps(chunk) + b"\n"
@@ -1,34 +1,88 @@
+import asyncio
 from datetime import datetime
-from fastapi.encoders import jsonable_encoder
+import logging
+import time
+from typing import AsyncIterable
 
+# 模組層級只匯入 BaseProvider 本身已經載入的部分；fastapi、aiohttp、HTTP 工具與選用的快取 / hedging
+# 在第一次使用時才匯入，讓 gateway 載入 provider plugin 時不必付出這些成本
 from mlflow.gateway.config import RouteConfig
 from mlflow.gateway.providers.base import BaseProvider, ProviderAdapter
-from mlflow.gateway.providers.utils import send_request
-from mlflow.gateway.schemas import completions
+from mlflow.gateway.schemas import chat, completions
 
+from ml_mlflow_provider.balancer import BackendState, LoadBalancer
 from ml_mlflow_provider.config import CustomLLMConfig
+from ml_mlflow_provider.metrics import (
+    REGISTRY,
+    THROUGHPUT_BUCKETS,
+    start_http_server,
+    start_mlflow_emitter,
+)
+from ml_mlflow_provider import ndjson
+
+_logger = logging.getLogger(__name__)
+
+ADAPTER_SECONDS = REGISTRY.histogram(
+    "custom_llm_adapter_seconds", "Time spent converting payloads in CustomLLMAdapter"
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "custom_llm_upstream_seconds", "Total time of backend /chat calls, including retries"
+)
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram(
+    "custom_llm_upstream_ttfb_seconds", "Time until the first streamed chunk arrives from the backend"
+)
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "custom_llm_tokens_per_second", "Completion tokens per second of upstream time", THROUGHPUT_BUCKETS
+)
+
+
+# 請求未指定時使用的取樣參數
+DEFAULT_SAMPLING_PARAMS = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "max_tokens": 2000,
+}
+# 從 MLflow 請求原樣轉送給後端 /chat 的取樣參數
+SAMPLING_PARAMS = ("temperature", "top_p", "frequency_penalty", "presence_penalty", "max_tokens", "stop", "seed")
 
 
 class CustomLLMAdapter(ProviderAdapter):
+    @classmethod
+    def _sampling_params(cls, payload, config):
+        """以請求中的取樣參數覆蓋預設值，並帶上 config 的 keep_alive（請求可自行指定）"""
+        params = dict(DEFAULT_SAMPLING_PARAMS)
+        params.update({key: payload[key] for key in SAMPLING_PARAMS if key in payload})
+        keep_alive = payload.get("keep_alive", config.keep_alive)
+        if keep_alive is not None:
+            params["keep_alive"] = keep_alive
+        return params
+
     @classmethod
     def completion_to_model(cls, payload, config):
         """
         將 MLflow 請求轉換為後端 LLM API 所需的格式。
-        設定 model、temperature、top_p、frequency_penalty、presence_penalty 與 max_tokens，
-        並將 MLflow 預設的 prompt 欄位轉換為 messages 格式。
-        """
-        api_request = {
-            "model": "llama3.1",
-            "temperature": 0.0,
-            "top_p": 0.95,
-            "frequency_penalty": 0,
-            "presence_penalty": 0,
-            "max_tokens": 2000,
-        }
+        取樣參數以請求為準（未指定時使用 DEFAULT_SAMPLING_PARAMS），
+        並將 MLflow 預設的 prompt 欄位轉換為 messages 格式。model 由 provider 依 route 設定補上。
+        """
+        api_request = cls._sampling_params(payload, config)
         user_prompt = payload.get("prompt", "")
         api_request["messages"] = [{"role": "user", "content": user_prompt}]
         return api_request
 
+    @classmethod
+    def chat_to_model(cls, payload, config):
+        """
+        將 MLflow llm/v1/chat 請求轉換為後端 LLM API 所需的格式。
+        messages 陣列原樣轉送（後端再交給 Ollama /api/chat），不再攤平成單一 prompt。
+        """
+        api_request = cls._sampling_params(payload, config)
+        api_request["messages"] = [
+            {"role": message["role"], "content": message.get("content") or ""} for message in payload["messages"]
+        ]
+        return api_request
+
     @classmethod
     def model_to_completions(cls, resp, config):
         """
@@ -81,6 +135,95 @@ class CustomLLMAdapter(ProviderAdapter):
             )
         )
 
+    @classmethod
+    def model_to_completions_streaming(cls, resp, config):
+        """
+        將後端 /chat 串流模式的單一 NDJSON chunk 轉換成 MLflow Gateway 的 StreamResponsePayload。
+        chunk 格式比照 OpenAI：choices[0].delta.content 為本次新增的文字。
+        """
+        choices = resp.get("choices", [])
+        if isinstance(choices, list) and len(choices) > 0:
+            choice = choices[0]
+            delta = choice.get("delta") or {}
+            content = delta.get("content", choice.get("text", ""))
+            finish_reason = choice.get("finish_reason")
+        else:
+            content = resp.get("response", "")
+            finish_reason = "stop" if resp.get("done") else None
+
+        return completions.StreamResponsePayload(
+            created=int(datetime.utcnow().timestamp()),
+            model=resp.get("model", "llama3.1"),
+            choices=[
+                completions.StreamChoice(
+                    index=0,
+                    text=content,
+                    finish_reason=finish_reason,
+                )
+            ],
+        )
+
+    @classmethod
+    def model_to_chat(cls, resp, config):
+        """將後端 /chat 的回應轉換成 MLflow Gateway llm/v1/chat 的 ResponsePayload"""
+        usage_info = resp.get("usage", {})
+        choices = resp.get("choices", [])
+        if isinstance(choices, list) and len(choices) > 0:
+            choice = choices[0]
+            message = choice.get("message") or {}
+            role = message.get("role", "assistant")
+            content = message.get("content", choice.get("text", ""))
+            finish_reason = choice.get("finish_reason", "stop")
+        else:
+            role = "assistant"
+            content = (resp.get("message") or {}).get("content", resp.get("response", ""))
+            finish_reason = "stop"
+
+        return chat.ResponsePayload(
+            created=int(datetime.utcnow().timestamp()),
+            model=resp.get("model", "llama3.1"),
+            choices=[
+                chat.Choice(
+                    index=0,
+                    message=chat.ResponseMessage(role=role, content=content),
+                    finish_reason=finish_reason,
+                )
+            ],
+            usage=chat.ChatUsage(
+                prompt_tokens=int(usage_info.get("prompt_tokens", 0)),
+                completion_tokens=int(usage_info.get("completion_tokens", 0)),
+                total_tokens=int(usage_info.get("total_tokens", 0)),
+            ),
+        )
+
+    @classmethod
+    def model_to_chat_streaming(cls, resp, config):
+        """將後端 /chat 串流模式的單一 NDJSON chunk 轉換成 llm/v1/chat 的 StreamResponsePayload"""
+        choices = resp.get("choices", [])
+        if isinstance(choices, list) and len(choices) > 0:
+            choice = choices[0]
+            delta = choice.get("delta") or {}
+            role = delta.get("role")
+            content = delta.get("content", "")
+            finish_reason = choice.get("finish_reason")
+        else:
+            message = resp.get("message") or {}
+            role = message.get("role")
+            content = message.get("content", "")
+            finish_reason = "stop" if resp.get("done") else None
+
+        return chat.StreamResponsePayload(
+            created=int(datetime.utcnow().timestamp()),
+            model=resp.get("model", "llama3.1"),
+            choices=[
+                chat.StreamChoice(
+                    index=0,
+                    finish_reason=finish_reason,
+                    delta=chat.StreamDelta(role=role, content=content),
+                )
+            ],
+        )
+
 
 class CustomLLMProvider(BaseProvider):
     """
@@ -93,13 +236,72 @@ class CustomLLMProvider(BaseProvider):
     def __init__(self, config: RouteConfig) -> None:
         super().__init__(config)
         self.config: CustomLLMConfig = config.model.config
+        self.route_name = config.name
+        # 後端使用的模型名稱取自 route 的 model.name（MLflow 不允許請求自行指定 model）
+        self.model_name = config.model.name
+        lb_config = self.config.load_balancing
+        self.balancer = LoadBalancer(
+            [BackendState(backend.url, backend.weight) for backend in self.config.api_url],
+            strategy=lb_config.strategy,
+            max_retries=lb_config.max_retries,
+            failure_threshold=lb_config.failure_threshold,
+            recovery_seconds=lb_config.recovery_seconds,
+        )
+        self.cache = None
+        cache_config = self.config.cache
+        if cache_config is not None and cache_config.enabled:
+            from ml_mlflow_provider.cache import ResponseCache
+
+            self.cache = ResponseCache(
+                max_entries=cache_config.max_entries,
+                ttl_seconds=cache_config.ttl_seconds,
+                disk_path=cache_config.disk_path,
+            )
+        self._cache_lookups = 0
+        # 非串流以完整回應、串流以第一個 chunk 的延遲分別決定 hedge 時機，共用額外負載上限
+        self.hedger = self.stream_hedger = None
+        hedging_config = self.config.hedging
+        if hedging_config is not None and hedging_config.enabled:
+            from ml_mlflow_provider.hedging import HedgeBudget, Hedger
+
+            budget = HedgeBudget(max_extra_load=hedging_config.max_extra_load)
+            self.hedger, self.stream_hedger = (
+                Hedger(
+                    self.route_name,
+                    budget,
+                    percentile=hedging_config.percentile,
+                    min_delay=hedging_config.min_delay_seconds,
+                    initial_delay=hedging_config.initial_delay_seconds,
+                    min_samples=hedging_config.min_samples,
+                    window=hedging_config.window,
+                )
+                for _ in range(2)
+            )
+        if self.config.metrics is not None and self.config.metrics.enabled:
+            self._setup_metrics()
 
     @property
     def base_url(self):
         """
-        取得後端 LLM API 的 Base URL（來自 config.yaml 中的 api_url）。
+        取得第一個後端 LLM API 的 Base URL（來自 config.yaml 中的 api_url）。
+        實際請求會經由 self.balancer 在所有後端間分配。
         """
-        return self.config.api_url
+        return self.config.api_url[0].url
+
+    @property
+    def backend_stats(self):
+        """各後端的進行中請求數、EWMA 延遲、請求 / 失敗次數與熔斷狀態"""
+        return self.balancer.stats()
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """連線錯誤、逾時與 5xx / 429 視為節點問題，可換節點重試；其餘 4xx 為請求本身的錯誤"""
+        import aiohttp
+        from fastapi import HTTPException
+
+        if isinstance(error, HTTPException):
+            return error.status_code >= 500 or error.status_code == 429
+        return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
 
     @property
     def headers(self):
@@ -112,6 +314,161 @@ class CustomLLMProvider(BaseProvider):
             "Content-Type": "application/json",
         }
 
+    @property
+    def cache_stats(self):
+        """回應快取的命中 / 未命中 / 淘汰統計，未啟用快取時為 None"""
+        return self.cache.stats() if self.cache is not None else None
+
+    @property
+    def hedge_stats(self):
+        """hedge 延遲與送出 / 勝出 / 因負載上限略過的次數，未啟用 hedging 時為 None"""
+        if self.hedger is None:
+            return None
+        return {"response": self.hedger.stats(), "stream": self.stream_hedger.stats()}
+
+    def _setup_metrics(self):
+        """開啟共用 registry，註冊快取與後端節點的 gauge，並依設定啟動 /metrics 與 MLflow 輸出"""
+        metrics_config = self.config.metrics
+        REGISTRY.enabled = True
+        route = {"route": self.route_name}
+        REGISTRY.gauge_callback(
+            "custom_llm_backend_outstanding",
+            "In-flight requests per backend",
+            lambda: [({**route, "backend": b["url"]}, b["outstanding"]) for b in self.backend_stats],
+        )
+        REGISTRY.gauge_callback(
+            "custom_llm_backend_failures",
+            "Failed requests per backend",
+            lambda: [({**route, "backend": b["url"]}, b["failures"]) for b in self.backend_stats],
+        )
+        if self.hedger is not None:
+            REGISTRY.gauge_callback(
+                "custom_llm_hedge_delay_seconds",
+                "Current hedge delay (percentile of recent latency / time to first chunk)",
+                lambda: [
+                    ({**route, "mode": "response"}, self.hedger.delay()),
+                    ({**route, "mode": "stream"}, self.stream_hedger.delay()),
+                ],
+            )
+        if self.cache is not None:
+            REGISTRY.gauge_callback(
+                "custom_llm_cache",
+                "Response cache counters",
+                lambda: [({**route, "stat": k}, v) for k, v in self.cache_stats.items()],
+            )
+        if metrics_config.port:
+            start_http_server(REGISTRY, metrics_config.port)
+        if metrics_config.mlflow_experiment:
+            start_mlflow_emitter(
+                REGISTRY, metrics_config.mlflow_experiment, metrics_config.mlflow_interval, run_name="custom_llm_gateway"
+            )
+
+    def _log_cache_stats(self):
+        interval = self.config.cache.stats_log_interval
+        self._cache_lookups += 1
+        if interval and self._cache_lookups % interval == 0:
+            _logger.info("Response cache stats for %s: %s", self.route_name, self.cache_stats)
+
+    async def _send_chat(self, api_request):
+        """
+        經負載平衡呼叫後端 /chat（非串流）並回傳解析後的 JSON，節點失敗時換節點重試；
+        有啟用 hedging 時，逾時未回應會再送一份到負載較低的節點，採用先完成者
+        """
+        from mlflow.gateway.providers.utils import send_request
+
+        def send():
+            return self.balancer.call(
+                lambda base_url: send_request(
+                    headers=self.headers,
+                    base_url=base_url,
+                    path="chat",  # 後端 API 路徑
+                    payload=api_request,
+                ),
+                is_retryable=self._is_retryable,
+            )
+
+        if self.hedger is not None:
+            return await self.hedger.call(send)
+        return await send()
+
+    def _to_model(self, convert, payload) -> dict:
+        """以 adapter 轉換請求並補上 route 設定的模型名稱"""
+        from fastapi.encoders import jsonable_encoder
+
+        payload_dict = jsonable_encoder(payload, exclude_none=True)
+        self.check_for_model_field(payload_dict)
+        with ADAPTER_SECONDS.time(route=self.route_name, stage="request"):
+            return {"model": self.model_name, **convert(payload_dict, self.config)}
+
+    async def _complete(self, api_request, convert):
+        """
+        呼叫後端 /chat（非串流）並以 convert 轉換回應：
+        有啟用快取且為確定性請求時先查快取，並合併相同的並行請求。
+        """
+        # 只有實際打到後端的請求才記錄上游耗時（快取命中與合併的請求不計）
+        upstream = {}
+
+        async def fetch():
+            started = time.perf_counter()
+            resp = await self._send_chat(api_request)
+            upstream["seconds"] = time.perf_counter() - started
+            return resp
+
+        if self.cache is not None and api_request.get("temperature", 0) == 0:
+            resp = await self.cache.get_or_fetch(self.cache.make_key(api_request), fetch)
+            self._log_cache_stats()
+        else:
+            resp = await fetch()
+
+        # 轉換為 MLflow 回應格式
+        with ADAPTER_SECONDS.time(route=self.route_name, stage="response"):
+            response = convert(resp, self.config)
+
+        if "seconds" in upstream:
+            UPSTREAM_SECONDS.observe(upstream["seconds"], route=self.route_name)
+            if upstream["seconds"] > 0 and response.usage.completion_tokens:
+                TOKENS_PER_SECOND.observe(response.usage.completion_tokens / upstream["seconds"], route=self.route_name)
+        return response
+
+    async def _stream_chat(self, api_request):
+        """以 stream=True 呼叫後端 /chat，逐一產生解析後的 NDJSON chunk"""
+        api_request = {**api_request, "stream": True}
+        if self.stream_hedger is not None:
+            # 第一個 chunk 遲遲未到時另開一條串流，採用先收到 chunk 的一方
+            chunks = self.stream_hedger.stream(lambda: self._open_stream(api_request))
+        else:
+            chunks = self._open_stream(api_request)
+        async for data in chunks:
+            yield data
+
+    async def _open_stream(self, api_request):
+        """對單一後端開啟 /chat 串流"""
+        from mlflow.gateway.providers.utils import send_stream_request
+
+        # 串流已開始回傳給客戶端後無法重送，因此只選一個節點、不重試
+        backend = self.balancer.pick()
+        started = time.perf_counter()
+        first_chunk = True
+        with self.balancer.track(backend, is_failure=self._is_retryable):
+            stream = send_stream_request(
+                headers=self.headers,
+                base_url=backend.url,
+                path="chat",
+                payload=api_request,
+            )
+            try:
+                # 網路 chunk 直接交給增量 NDJSON 解析器切行（同時相容 SSE 的 "data: " 前綴與 [DONE]），
+                # 不先串接成字串
+                async for data in ndjson.iter_ndjson(stream, sse=True):
+                    if first_chunk:
+                        UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - started, route=self.route_name)
+                        first_chunk = False
+                    yield data
+            finally:
+                await stream.aclose()
+
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, route=self.route_name)
+
     async def completions(self, payload: completions.RequestPayload) -> completions.ResponsePayload:
         """
         MLflow Gateway 接收到 /completions 請求後：
@@ -119,19 +476,31 @@ class CustomLLMProvider(BaseProvider):
           2. 使用 send_request 非同步呼叫後端 LLM API
           3. 將 API 回應轉換成 MLflow Gateway / UI 所需的格式 (model_to_completions)
         """
-        payload_dict = jsonable_encoder(payload, exclude_none=True)
-        self.check_for_model_field(payload_dict)
+        api_request = self._to_model(CustomLLMAdapter.completion_to_model, payload)
+        return await self._complete(api_request, CustomLLMAdapter.model_to_completions)
 
-        # 取得後端 API 所需格式
-        api_request = CustomLLMAdapter.completion_to_model(payload_dict, self.config)
+    async def completions_stream(
+        self, payload: completions.RequestPayload
+    ) -> AsyncIterable[completions.StreamResponsePayload]:
+        """
+        MLflow Gateway 接收到 stream=True 的 /completions 請求後：
+          1. 以 stream=True 呼叫後端 /chat，取得 NDJSON 串流
+          2. 每收到一行就轉換成 StreamResponsePayload 立即回傳，不等待完整生成
+        """
+        api_request = self._to_model(CustomLLMAdapter.completion_to_model, payload)
+        async for data in self._stream_chat(api_request):
+            yield CustomLLMAdapter.model_to_completions_streaming(data, self.config)
 
-        # 呼叫後端 API
-        resp = await send_request(
-            headers=self.headers,
-            base_url=self.base_url,
-            path="chat",  # 後端 API 路徑
-            payload=api_request,
-        )
+    async def chat(self, payload: chat.RequestPayload) -> chat.ResponsePayload:
+        """
+        MLflow Gateway 接收到 llm/v1/chat 請求後，將 messages 陣列原樣轉送給後端 /chat，
+        回應轉換成 chat.ResponsePayload（快取與指標與 completions 相同）
+        """
+        api_request = self._to_model(CustomLLMAdapter.chat_to_model, payload)
+        return await self._complete(api_request, CustomLLMAdapter.model_to_chat)
 
-        # 轉換為 MLflow 回應格式
-        return CustomLLMAdapter.model_to_completions(resp, self.config)
+    async def chat_stream(self, payload: chat.RequestPayload) -> AsyncIterable[chat.StreamResponsePayload]:
+        """llm/v1/chat 的串流版本，每個後端 chunk 轉換成 chat.StreamResponsePayload 立即回傳"""
+        api_request = self._to_model(CustomLLMAdapter.chat_to_model, payload)
+        async for data in self._stream_chat(api_request):
+            yield CustomLLMAdapter.model_to_chat_streaming(data, self.config)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import mlflow
+from mlflow.entities import Metric, Param
+from mlflow.tracking import MlflowClient
+
+_logger = logging.getLogger(__name__)
+
+# MLflow log_batch 單次請求的上限
+MAX_PARAMS_PER_BATCH = 100
+MAX_METRICS_PER_BATCH = 1000
+
+
+class TrackingFlushError(RuntimeError):
+    """BufferedTracker.close() 重試後仍有資料無法上傳"""
+
+    def __init__(self, run_id, records):
+        super().__init__(f"{len(records)} buffered MLflow records could not be uploaded to run {run_id}")
+        self.run_id = run_id
+        self.records = records
+
+
+def span_payload(value, max_chars=2000):
+    """Keep short span values as-is; replace long strings by a hash reference plus a short preview."""
+    if not isinstance(value, str) or len(value) <= max_chars:
+        return value
+    return {
+        "sha256": hashlib.sha256(value.encode("utf-8")).hexdigest(),
+        "chars": len(value),
+        "preview": value[:max_chars],
+    }
+
+
+class SyncTracker:
+    """Log straight to the active MLflow run (one tracking call per log)."""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+
+    def span_value(self, value):
+        return value
+
+    def log_param(self, key, value):
+        mlflow.log_param(key, value)
+
+    def log_params(self, params):
+        mlflow.log_params(params)
+
+    def log_metric(self, key, value, step=None):
+        mlflow.log_metric(key, value, step=step)
+
+    def log_metrics(self, metrics, step=None):
+        mlflow.log_metrics(metrics, step=step)
+
+    def log_text(self, text, artifact_file):
+        mlflow.log_text(text, artifact_file=artifact_file)
+
+    def log_dict(self, dictionary, artifact_file):
+        mlflow.log_dict(dictionary, artifact_file=artifact_file)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BufferedTracker(SyncTracker):
+    """
+    Buffer params, metrics and text artifacts and upload them from a background thread.
+
+    記錄呼叫只把資料放進佇列就返回，不會卡在 LLM 呼叫之間；
+    背景 thread 每 flush_interval 秒以 log_batch 與一次 log_artifacts 批次上傳。
+    params、metrics、文字檔各自上傳，上傳失敗的項目放回佇列，下一輪最多再試 max_attempts 次；
+    close() 會等待所有資料上傳完畢，仍失敗的項目在呼叫端再同步上傳一次，
+    還是失敗則 raise TrackingFlushError。必須在 run 結束前呼叫（或以 with 使用）。
+    """
+
+    def __init__(self, run_id, flush_interval=5.0, span_max_chars=2000, max_attempts=3):
+        super().__init__(run_id)
+        self.client = MlflowClient()
+        self.flush_interval = flush_interval
+        self.span_max_chars = span_max_chars
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        # 背景 thread 重試 max_attempts 次仍失敗的項目，由 close() 處理
+        self._failed = []
+        self._flush_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name=f"mlflow-tracker-{run_id}", daemon=True)
+        self._thread.start()
+
+    def span_value(self, value):
+        return span_payload(value, self.span_max_chars)
+
+    def _put(self, item):
+        with self._flushed:
+            self._pending += 1
+        # (種類, 資料, 已嘗試次數)
+        self._queue.put(item + (0,))
+
+    def log_param(self, key, value):
+        self._put(("param", Param(key, str(value))))
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key, value, step=None):
+        self._put(("metric", Metric(key, float(value), int(time.time() * 1000), step or 0)))
+
+    def log_metrics(self, metrics, step=None):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step=step)
+
+    def log_text(self, text, artifact_file):
+        self._put(("text", (artifact_file, text)))
+
+    def log_dict(self, dictionary, artifact_file):
+        self.log_text(json.dumps(dictionary, indent=2, ensure_ascii=False), artifact_file)
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _upload_batches(self, items, batch_size, kind):
+        """逐批 log_batch，回傳上傳失敗的項目"""
+        failed = []
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i + batch_size]
+            try:
+                self.client.log_batch(self.run_id, **{kind: [value for _, value, _ in batch]})
+            except Exception as e:
+                _logger.warning("Failed to upload %d buffered MLflow %s for run %s: %s", len(batch), kind, self.run_id, e)
+                failed.extend(batch)
+        return failed
+
+    def _upload_texts(self, texts):
+        """先寫到暫存目錄，再以一次 log_artifacts 上傳全部文字檔；失敗時回傳全部項目"""
+        tmp_dir = tempfile.mkdtemp(prefix="mlflow-tracker-")
+        try:
+            for _, (artifact_file, text), _ in texts:
+                path = os.path.join(tmp_dir, artifact_file)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+            self.client.log_artifacts(self.run_id, tmp_dir)
+        except Exception as e:
+            _logger.warning("Failed to upload %d buffered MLflow artifacts for run %s: %s", len(texts), self.run_id, e)
+            return texts
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return []
+
+    def _upload(self, items):
+        """params、metrics、文字檔各自上傳，其中一種失敗不影響其他種類；回傳上傳失敗的項目"""
+        params = [item for item in items if item[0] == "param"]
+        metrics = [item for item in items if item[0] == "metric"]
+        texts = [item for item in items if item[0] == "text"]
+
+        failed = self._upload_batches(params, MAX_PARAMS_PER_BATCH, "params")
+        failed += self._upload_batches(metrics, MAX_METRICS_PER_BATCH, "metrics")
+        if texts:
+            failed += self._upload_texts(texts)
+        return failed
+
+    def _flush_once(self):
+        items = self._drain()
+        if not items:
+            return
+        done = len(items)
+        try:
+            for kind, value, attempts in self._upload(items):
+                if attempts + 1 < self.max_attempts:
+                    # 放回佇列，下一輪再試；仍算在 pending 內，flush() 會繼續等待
+                    self._queue.put((kind, value, attempts + 1))
+                    done -= 1
+                else:
+                    self._failed.append((kind, value, attempts + 1))
+        finally:
+            with self._flushed:
+                self._pending -= done
+                self._flushed.notify_all()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self._flush_once()
+        self._flush_once()
+
+    def flush(self):
+        """Block until everything logged so far has been uploaded or has used up its retries."""
+        with self._flushed:
+            self._flush_requested.set()
+            self._flushed.wait_for(lambda: self._pending == 0)
+
+    def close(self):
+        self.flush()
+        self._stopped.set()
+        self._flush_requested.set()
+        self._thread.join()
+        # 背景重試都失敗（或停止後才放入佇列）的項目，在呼叫端同步再上傳一次；仍失敗則讓呼叫端知道資料不完整
+        failed, self._failed = self._failed + self._drain(), []
+        if not failed:
+            return
+        failed = self._upload(failed)
+        if failed:
+            raise TrackingFlushError(self.run_id, [(kind, value) for kind, value, _ in failed])
+
+
+def make_tracker(mode, run_id, **kwargs):
+    """Return a tracker for mode "sync" or "buffered"."""
+    if mode == "buffered":
+        return BufferedTracker(run_id, **kwargs)
+    if mode == "sync":
+        return SyncTracker(run_id)
+    raise ValueError(f"Unknown tracking mode {mode!r}, expected 'sync' or 'buffered'")
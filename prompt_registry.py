@@ -0,0 +1,129 @@
+"""
+Named, versioned prompt templates loaded from prompt_templates/.
+
+    prompt_templates/<name>/<version>.txt
+
+模板使用 str.format 的 {field} 佔位符（{{ }} 為大括號本身），載入時即拆解成固定文字與欄位，
+render 只需串接，不必每次重新解析。每個版本以內容 sha256 識別，
+PROMPT_TEMPLATE_VERSIONS="evaluate_rules=v2,re_answer=v1" 或 select() 可切換版本做 A/B 比較。
+"""
+import hashlib
+import os
+import re
+import threading
+from string import Formatter
+
+from liberty_prompt import estimate_tokens
+
+DEFAULT_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_templates")
+
+
+def _version_key(version):
+    """v2 < v10：數字部分以數值比較"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", version)]
+
+
+class PromptTemplate:
+    """A single template version, split once into literal text and field names."""
+
+    def __init__(self, name, version, text):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self._parts = []
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            if format_spec or conversion or (field is not None and not field.isidentifier()):
+                raise ValueError(f"Template {self.ref}: only plain {{field}} placeholders are supported")
+            self._parts.append((literal, field))
+        self.fields = tuple(dict.fromkeys(field for _, field in self._parts if field))
+        # 模板本身（不含欄位值）的估計 token 數
+        self.static_tokens = estimate_tokens("".join(literal for literal, _ in self._parts))
+
+    @property
+    def ref(self):
+        """Short identifier logged with each run, e.g. evaluate_rules@v1#1a2b3c4d5e6f."""
+        return f"{self.name}@{self.version}#{self.sha256[:12]}"
+
+    def render(self, **values):
+        missing = [field for field in self.fields if field not in values]
+        if missing:
+            raise KeyError(f"Template {self.ref} is missing values for {missing}")
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field:
+                pieces.append(str(values[field]))
+        return "".join(pieces)
+
+    def estimate_tokens(self, **values):
+        """Estimated prompt tokens once rendered with values."""
+        return self.static_tokens + sum(estimate_tokens(str(values.get(field, ""))) for field in self.fields)
+
+
+class PromptRegistry:
+    """Load every template under directory once and hand out the selected version of each."""
+
+    def __init__(self, directory=DEFAULT_TEMPLATE_DIR, selected=None):
+        self.directory = directory
+        self._selected = dict(selected or {})
+        self._templates = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, directory=DEFAULT_TEMPLATE_DIR, env_var="PROMPT_TEMPLATE_VERSIONS"):
+        """Build a registry whose selections come from "name=version,..." in env_var."""
+        selected = {}
+        for item in os.getenv(env_var, "").split(","):
+            if "=" in item:
+                name, version = item.split("=", 1)
+                selected[name.strip()] = version.strip()
+        return cls(directory, selected)
+
+    def _load(self):
+        templates = {}
+        for name in sorted(os.listdir(self.directory)):
+            template_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(template_dir):
+                continue
+            for filename in os.listdir(template_dir):
+                version, ext = os.path.splitext(filename)
+                if ext != ".txt":
+                    continue
+                with open(os.path.join(template_dir, filename), "r", encoding="utf-8") as f:
+                    templates.setdefault(name, {})[version] = PromptTemplate(name, version, f.read())
+        return templates
+
+    @property
+    def templates(self):
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = self._load()
+        return self._templates
+
+    def versions(self, name):
+        return sorted(self.templates.get(name, {}), key=_version_key)
+
+    def select(self, name, version):
+        """Use version for name from now on (validated against the loaded files)."""
+        if version not in self.templates.get(name, {}):
+            raise KeyError(f"Unknown prompt template {name}@{version}, available: {self.versions(name)}")
+        self._selected[name] = version
+
+    def get(self, name, version=None):
+        """Return the requested version, else the selected one, else the latest."""
+        versions = self.templates.get(name)
+        if not versions:
+            raise KeyError(f"Unknown prompt template {name!r} in {self.directory}")
+        version = version or self._selected.get(name) or self.versions(name)[-1]
+        if version not in versions:
+            raise KeyError(f"Unknown prompt template {name}@{version}, available: {self.versions(name)}")
+        return versions[version]
+
+    def render(self, name, **values):
+        return self.get(name).render(**values)
+
+    def refs(self, names):
+        """{name: ref} of the versions that get() currently returns, for logging with a run."""
+        return {name: self.get(name).ref for name in names}
@@ -0,0 +1,75 @@
+import re
+
+# 比對 "Rule 3:"、"**Rule 3:**"、"Rule:" 等開頭的行
+RULE_HEADER = re.compile(r"^\W*rule\s*\d*\s*[:：.]\**\s*", re.IGNORECASE)
+
+
+def parse_rules(text):
+    """Split LLM output into rule blocks, one per "Rule N:" header (header included)."""
+    blocks = []
+    current = None
+    for line in text.splitlines():
+        if RULE_HEADER.match(line):
+            if current:
+                blocks.append("\n".join(current).strip())
+            current = [line]
+        elif current is not None:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current).strip())
+    return blocks
+
+
+def _split_block(block):
+    """Return (statement, detail_lines) of a block; handles "Rule:" followed by the statement on the next line."""
+    lines = block.splitlines()
+    if not lines:
+        return "", []
+    statement = RULE_HEADER.sub("", lines[0]).strip(" *")
+    rest = lines[1:]
+    if not statement:
+        while rest and not rest[0].strip():
+            rest = rest[1:]
+        if rest:
+            statement, rest = rest[0].strip(" *"), rest[1:]
+    return statement, rest
+
+
+def rule_statement(block):
+    """Return the rule sentence of a block without its "Rule N:" prefix."""
+    return _split_block(block)[0]
+
+
+def normalize_rule(block):
+    """Normalize a rule statement for comparison: lowercase, no markup, collapsed whitespace."""
+    statement = re.sub(r"[`*_\"'.]", "", rule_statement(block).lower())
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def rule_similarity(text_a, text_b):
+    """Jaccard overlap of the normalized rule statements of two rule outputs (0.0 - 1.0)."""
+    rules_a = {normalize_rule(block) for block in parse_rules(text_a)} - {""}
+    rules_b = {normalize_rule(block) for block in parse_rules(text_b)} - {""}
+    if not rules_a and not rules_b:
+        # 無法解析出任何規則時退回逐字比較
+        return 1.0 if text_a.strip() == text_b.strip() else 0.0
+    return len(rules_a & rules_b) / len(rules_a | rules_b)
+
+
+def merge_rule_sets(rule_texts):
+    """Merge several rule outputs into one deduplicated, renumbered rule set."""
+    seen = set()
+    merged = []
+    for text in rule_texts:
+        for block in parse_rules(text):
+            key = normalize_rule(block)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            merged.append(block)
+
+    renumbered = []
+    for i, block in enumerate(merged, start=1):
+        statement, rest = _split_block(block)
+        renumbered.append("\n".join([f"Rule {i}: {statement}", *rest]))
+    return "\n\n".join(renumbered)
@@ -0,0 +1,228 @@
+"""
+Semantic cache for near-duplicate LLM prompts.
+
+相似 cell 的 rule 生成 prompt 幾乎相同（只差幾個 pin 屬性），完全相同才命中的快取幫助有限。
+這裡把 prompt 轉成向量，與已快取的 prompt 比較 cosine 相似度，超過 threshold 時直接回傳快取的回答：
+
+  - 預設以 hashed byte n-gram 計算向量（純 NumPy、不需下載模型）
+  - SEMANTIC_CACHE_EMBEDDER="st:<model>" 改用本機 CPU 上的 sentence-transformers 模型（選用套件）
+  - 向量存在固定大小的 NumPy 矩陣中，一次矩陣乘法比較全部項目；額滿時淘汰最久未使用的項目
+  - namespace（例如模板名稱）不同的 prompt 永遠不會互相命中；scope（例如 MLflow run id）相同的項目也一律不命中，
+    同一個 run 的後續迭代不會拿到前一次迭代的回答
+  - 相似度只以 embed_text（prompt 中會變動的部分）計算，很長的共同前綴不會讓不相關的 prompt 互相命中
+"""
+import hashlib
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+from liberty_prompt import estimate_tokens
+
+# 64-bit 乘法雜湊常數（golden ratio），n-gram 編碼乘上後取高位元作為 bucket
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class HashedNgramEmbedder:
+    """Signed feature hashing of overlapping byte n-grams, L2-normalized."""
+
+    def __init__(self, dim: int = 2048, n: int = 4):
+        if not 1 <= n <= 8:
+            raise ValueError("n must be between 1 and 8")
+        self.dim = dim
+        self.n = n
+        self.name = f"ngram{n}x{dim}"
+
+    def embed(self, text: str) -> np.ndarray:
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.uint64)
+        if len(data) < self.n:
+            data = np.pad(data, (0, self.n - len(data)))
+        # 每個位置的 n-gram 編碼成一個 64-bit 整數：codes[i] = bytes[i:i+n]
+        count = len(data) - self.n + 1
+        codes = np.zeros(count, dtype=np.uint64)
+        for offset in range(self.n):
+            codes = (codes << np.uint64(8)) | data[offset:offset + count]
+        hashed = codes * _HASH_MULTIPLIER
+        buckets = (hashed >> np.uint64(32)) % np.uint64(self.dim)
+        signs = ((hashed >> np.uint64(31)) & np.uint64(1)).astype(np.float32) * 2 - 1
+        vector = np.bincount(buckets.astype(np.intp), weights=signs, minlength=self.dim).astype(np.float32)
+        # 重複出現的 n-gram 以 log 壓低權重，避免長 prompt 的共同前綴主導相似度
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    """Local CPU embedding model from sentence-transformers (optional dependency)."""
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The sentence-transformers embedder requires `pip install sentence-transformers`"
+            ) from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+def make_embedder(spec: str = "ngram"):
+    """"ngram" → HashedNgramEmbedder；"st" 或 "st:<model>" → SentenceTransformerEmbedder"""
+    if spec == "ngram":
+        return HashedNgramEmbedder()
+    if spec == "st" or spec.startswith("st:"):
+        model_name = spec.partition(":")[2]
+        return SentenceTransformerEmbedder(model_name) if model_name else SentenceTransformerEmbedder()
+    raise ValueError(f"Unknown embedder {spec!r}, expected 'ngram' or 'st:<model>'")
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of prompt → answer.
+
+    相同 prompt（sha256 相同）直接命中；否則在同 namespace、semantic=True 的項目中找 cosine 相似度最高者，
+    達到 threshold 才視為命中。最多保存 max_entries 筆，額滿時覆寫最久未使用的項目。
+    embed() 與 LLM 呼叫都在 lock 外進行，可供多個 thread 同時使用。
+    """
+
+    def __init__(self, embedder=None, threshold: float = 0.97, max_entries: int = 512):
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._vectors = np.zeros((max_entries, self.embedder.dim), dtype=np.float32)
+        self._namespaces = np.full(max_entries, -1, dtype=np.int32)
+        self._scopes = np.full(max_entries, -1, dtype=np.int32)
+        self._semantic = np.zeros(max_entries, dtype=bool)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._answers: list[Optional[str]] = [None] * max_entries
+        self._hashes: list[Optional[str]] = [None] * max_entries
+        self._slot_by_hash: dict[str, int] = {}
+        self._namespace_ids: dict[str, int] = {}
+        self._scope_ids: dict[str, int] = {}
+        self._size = 0
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "exact_hits": 0, "evictions": 0, "tokens_saved": 0}
+
+    @staticmethod
+    def _hash(namespace: str, prompt: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _touch(self, slot: int):
+        self._tick += 1
+        self._last_used[slot] = self._tick
+
+    def _scope_id(self, scope: Optional[str]) -> int:
+        # 未指定 scope 的查詢以 -2 表示，不會等於任何項目的 scope（未指定 scope 的項目為 -1）
+        return self._scope_ids.get(scope, -2) if scope is not None else -2
+
+    def _lookup(self, prompt: str, namespace: str, scope: Optional[str], vector: Optional[np.ndarray]):
+        """回傳 (answer, similarity, exact)；vector 為 None 時只做完全相同的比對"""
+        key = self._hash(namespace, prompt)
+        with self._lock:
+            scope_id = self._scope_id(scope)
+            slot = self._slot_by_hash.get(key)
+            if slot is not None and self._scopes[slot] != scope_id:
+                self._touch(slot)
+                return self._answers[slot], 1.0, True
+            namespace_id = self._namespace_ids.get(namespace)
+            if vector is None or namespace_id is None or not self._size:
+                return None, 0.0, False
+            size = self._size
+            similarities = self._vectors[:size] @ vector
+            excluded = (
+                (self._namespaces[:size] != namespace_id)
+                | (self._scopes[:size] == scope_id)
+                | ~self._semantic[:size]
+            )
+            similarities[excluded] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None, similarity, False
+            self._touch(best)
+            return self._answers[best], similarity, False
+
+    def lookup(self, prompt: str, namespace: str = "", embed_text: Optional[str] = None,
+               scope: Optional[str] = None, semantic: bool = True):
+        """
+        回傳 (answer, similarity)；沒有可用的項目時回傳 (None, 最高相似度)。
+        embed_text 為 prompt 中會變動的部分（例如 cell 內容），只以它計算相似度，
+        避免很長的共同前綴讓不相關的 prompt 看起來幾乎相同；scope 相同的項目一律不會命中。
+        """
+        vector = self.embedder.embed(prompt if embed_text is None else embed_text) if semantic else None
+        answer, similarity, _ = self._lookup(prompt, namespace, scope, vector)
+        return answer, similarity
+
+    def store(self, prompt: str, answer: str, namespace: str = "", embed_text: Optional[str] = None,
+              scope: Optional[str] = None, semantic: bool = True, vector: Optional[np.ndarray] = None):
+        """semantic=False 的項目只供完全相同的 prompt 命中"""
+        key = self._hash(namespace, prompt)
+        if semantic and vector is None:
+            vector = self.embedder.embed(prompt if embed_text is None else embed_text)
+        with self._lock:
+            slot = self._slot_by_hash.get(key)
+            if slot is None:
+                if self._size < self.max_entries:
+                    slot = self._size
+                    self._size += 1
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    del self._slot_by_hash[self._hashes[slot]]
+                    self._counters["evictions"] += 1
+                self._slot_by_hash[key] = slot
+            namespace_id = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            self._vectors[slot] = vector if vector is not None else 0.0
+            self._namespaces[slot] = namespace_id
+            self._scopes[slot] = -1 if scope is None else self._scope_ids.setdefault(scope, len(self._scope_ids))
+            self._semantic[slot] = vector is not None
+            self._answers[slot] = answer
+            self._hashes[slot] = key
+            self._touch(slot)
+
+    def get_or_call(self, prompt: str, call: Callable[[], str], namespace: str = "", stats: Optional[dict] = None,
+                    embed_text: Optional[str] = None, scope: Optional[str] = None, semantic: bool = True):
+        """
+        命中時回傳快取的回答，否則呼叫 call() 並存入快取。
+        embed_text、scope、semantic 的意義同 lookup()；
+        stats 若有提供，會累加本次的 lookups / hits / tokens_saved（供單一 MLflow run 記錄）。
+        """
+        vector = self.embedder.embed(prompt if embed_text is None else embed_text) if semantic else None
+        answer, _, exact = self._lookup(prompt, namespace, scope, vector)
+        hit = answer is not None
+        # 省下的 token 以 prompt 與快取回答的估計 token 數計算
+        saved = estimate_tokens(prompt) + estimate_tokens(answer) if hit else 0
+        with self._lock:
+            self._counters["lookups"] += 1
+            if hit:
+                self._counters["hits"] += 1
+                self._counters["exact_hits"] += exact
+                self._counters["tokens_saved"] += saved
+        if stats is not None:
+            stats["lookups"] = stats.get("lookups", 0) + 1
+            stats["hits"] = stats.get("hits", 0) + hit
+            stats["tokens_saved"] = stats.get("tokens_saved", 0) + saved
+        if hit:
+            return answer
+
+        answer = call()
+        self.store(prompt, answer, namespace, scope=scope, semantic=semantic, vector=vector)
+        return answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters, entries=self._size)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+    def params(self) -> dict:
+        """設定值，與 stats() 一起記錄到 MLflow 方便比較不同 threshold 的效果"""
+        return {
+            "semantic_cache_embedder": self.embedder.name,
+            "semantic_cache_threshold": self.threshold,
+            "semantic_cache_max_entries": self.max_entries,
+        }
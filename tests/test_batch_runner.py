@@ -0,0 +1,69 @@
+import asyncio
+import functools
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import batch_runner
+
+
+def run(tmp_path, monkeypatch, lines, handler, *extra):
+    input_path = tmp_path / "requests.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    input_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    monkeypatch.setattr(
+        batch_runner.httpx, "AsyncClient",
+        functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)),
+    )
+    args = batch_runner.parse_args([
+        str(input_path), str(output_path), "--concurrency", "1", "--retry-backoff", "0", "--progress-every", "0",
+        *extra,
+    ])
+    counters = asyncio.run(asyncio.wait_for(batch_runner.run_batch(args), timeout=10))
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    return counters, {record["request_id"]: record for record in records}
+
+
+def echo(request):
+    return httpx.Response(200, json={"echo": json.loads(request.content)["prompt"]})
+
+
+def test_bad_lines_become_error_records_without_stopping_the_batch(tmp_path, monkeypatch):
+    lines = [
+        json.dumps({"request_id": "ok-1", "prompt": "hello"}),
+        json.dumps({"request_id": "no-prompt", "body": "wrong field"}),
+        "{not json",
+        "",
+        json.dumps(["not", "an", "object"]),
+    ] + [json.dumps({"request_id": f"ok-{i}", "prompt": f"p{i}"}) for i in range(2, 8)]
+
+    counters, records = run(tmp_path, monkeypatch, lines, echo)
+
+    assert counters == {"ok": 7, "error": 3, "skipped": 0}
+    assert records["ok-7"]["response"] == {"echo": "p7"}
+    assert "missing 'prompt' field" in records["no-prompt"]["error"]
+    assert "invalid JSON on line 3" in records[2]["error"]
+    assert "not a JSON object" in records[4]["error"]
+
+
+def test_transient_errors_are_retried_within_the_run(tmp_path, monkeypatch):
+    calls = {"flaky": 0, "down": 0}
+
+    def handler(request):
+        prompt = json.loads(request.content)["prompt"]
+        calls[prompt] += 1
+        if prompt == "flaky" and calls[prompt] == 1:
+            return httpx.Response(503)
+        if prompt == "down":
+            raise httpx.ConnectError("connection refused")
+        return httpx.Response(200, json={"ok": True})
+
+    lines = [json.dumps({"request_id": name, "prompt": name}) for name in ("flaky", "down")]
+    counters, records = run(tmp_path, monkeypatch, lines, handler, "--retries", "2")
+
+    assert records["flaky"]["attempts"] == 2 and records["flaky"]["response"] == {"ok": True}
+    assert records["down"]["attempts"] == 3 and "connection refused" in records["down"]["error"]
+    assert calls == {"flaky": 2, "down": 3}
+    assert counters == {"ok": 1, "error": 1, "skipped": 0}
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from completion_cache import CompletionCache
+
+
+def test_concurrent_misses_for_one_key_call_the_api_once(tmp_path):
+    cache = CompletionCache(str(tmp_path))
+    calls = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            calls.append(1)
+        time.sleep(0.05)
+        return "rules"
+
+    key = CompletionCache.key({"prompt": "p", "temperature": 0.1})
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: cache.get_or_call(key, call), range(32)))
+
+    assert results == ["rules"] * 32
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 31
+
+
+def test_distinct_keys_are_fetched_in_parallel_and_persisted(tmp_path):
+    cache = CompletionCache(str(tmp_path))
+    barrier = threading.Barrier(8, timeout=5)
+
+    def fetch(i):
+        def call():
+            # 不同 key 不會互相阻塞，8 個 thread 都能同時抵達 barrier
+            barrier.wait()
+            return f"answer {i}"
+        return cache.get_or_call(CompletionCache.key({"prompt": i}), call)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(fetch, range(8))) == [f"answer {i}" for i in range(8)]
+
+    reloaded = CompletionCache(str(tmp_path))
+    assert reloaded.get(CompletionCache.key({"prompt": 3})) == "answer 3"
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = CompletionCache(str(tmp_path))
+    key = CompletionCache.key({"prompt": "p"})
+    path = os.path.join(str(tmp_path), key[:2], f"{key}.json")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write('{"comp')
+
+    assert cache.get_or_call(key, lambda: "fresh") == "fresh"
+    assert CompletionCache(str(tmp_path)).get(key) == "fresh"
+
+
+def test_failed_call_is_not_cached():
+    cache = CompletionCache()
+
+    def fail():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_call("k", fail)
+    assert cache.get_or_call("k", lambda: "ok") == "ok"
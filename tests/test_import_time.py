@@ -0,0 +1,23 @@
+import pytest
+
+from benchmarks.import_time import MAX_RSS_MB, MAX_SECONDS, profile
+
+
+def test_provider_import_stays_within_budget():
+    pytest.importorskip("mlflow")
+    config = pytest.importorskip("mlflow.gateway.config")
+    if not hasattr(config, "RouteConfig"):
+        pytest.skip("installed mlflow has no gateway RouteConfig, which the provider plugin requires")
+    assert_within_budget(profile("ml_mlflow_provider.providers"))
+
+
+def test_llm_api_import_stays_within_budget():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    assert_within_budget(profile("llm_api"))
+
+
+def assert_within_budget(report):
+    assert "error" not in report, report["error"]
+    assert report["seconds"] < MAX_SECONDS
+    assert report["rss_mb"] < MAX_RSS_MB
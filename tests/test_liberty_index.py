@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("liberty.parser")
+
+from liberty_index import load_or_build
+from liberty_prompt import serialize_library
+
+LIB = """library(test) {
+  cell (ISO) {
+    area : 1.5;
+    is_isolation_cell : true;
+    pg_pin (VDD) { pg_type : primary_power; voltage_name : VDD; }
+    pin (A) {
+      direction : input;
+      related_power_pin : VDD;
+      isolation_cell_data_pin : true;
+      capacitance : 0.0012;
+      timing () { related_pin : "EN"; cell_rise (scalar) { values ("0.1"); } }
+    }
+  }
+  cell (HDR) {
+    switch_cell_type : coarse_grain;
+    pg_pin (VDDC) { pg_type : internal_power; switch_function : "SD"; switch_pin : true; }
+    pin (SD) { direction : input; capacitance : 0.002; }
+  }
+}
+"""
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_index_records_raw_size_for_savings_report(tmp_path, streaming):
+    lib_path = tmp_path / "test.lib"
+    lib_path.write_text(LIB)
+
+    with load_or_build(str(lib_path), cache_dir=str(tmp_path / "cache"), streaming=streaming) as index:
+        assert index.cell_names() == ["ISO", "HDR"]
+        assert index.cell("HDR")["pg_pins"]["VDDC"]["switch_pin"] == "true"
+        assert index.raw_tokens > 0
+        report = serialize_library(index, raw_tokens=index.raw_tokens).report()
+
+    assert report["prompt_tokens_raw"] == index.raw_tokens
+    assert report["prompt_tokens_saved"] > 0
@@ -0,0 +1,33 @@
+from liberty_prompt import extract_cell, format_cell, serialize_library
+
+
+class Group:
+    """Minimal stand-in for a liberty-parser group."""
+
+    def __init__(self, group_name, name, attributes=None, groups=()):
+        self.group_name = group_name
+        self.args = [name]
+        self.attributes = attributes or {}
+        self.groups = list(groups)
+
+
+def make_cell():
+    return Group("cell", "HDR", {"switch_cell_type": "coarse_grain", "area": "3.2"}, [
+        Group("pg_pin", "VDDC", {"pg_type": "primary_power", "switch_function": '"SD"', "switch_pin": "true",
+                                 "user_pg_type": "switched", "capacitance": "0.1"}),
+        Group("pin", "SD", {"direction": "input", "related_power_pin": "VDD", "capacitance": "0.002"}),
+    ])
+
+
+def test_compact_cell_keeps_pg_pin_switch_attributes():
+    cell = extract_cell(make_cell())
+    assert cell["pg_pins"]["VDDC"] == {
+        "pg_type": "primary_power", "switch_function": "SD", "switch_pin": "true", "user_pg_type": "switched",
+    }
+    assert cell["attributes"] == {"switch_cell_type": "coarse_grain"}
+    assert "pg_pin VDDC: pg_type=primary_power, switch_function=SD, switch_pin=true" in format_cell(cell)
+
+
+def test_serialize_library_reports_savings_against_raw_tokens():
+    compact = serialize_library([make_cell()], raw_tokens=1000)
+    assert compact.report()["prompt_tokens_saved"] == 1000 - compact.tokens
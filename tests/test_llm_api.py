@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+import llm_api
+from llm_scheduler import FakeOllamaBackend, MicroBatchScheduler
+
+
+def post_chat(backend, body):
+    """經由以 FakeOllamaBackend 為後端的排程器呼叫 /chat"""
+
+    async def main():
+        scheduler = MicroBatchScheduler(backend, max_wait_ms=1)
+        await scheduler.start()
+        llm_api.app.state.scheduler = scheduler
+        llm_api.app.state.fair_queue = None
+        transport = httpx.ASGITransport(app=llm_api.app, raise_app_exceptions=False)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/chat", params={"api_key": "kelly"}, json=body)
+        finally:
+            await scheduler.stop()
+
+    return asyncio.run(asyncio.wait_for(main(), timeout=10))
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_streaming_upstream_error_returns_error_status_through_scheduler():
+    response = post_chat(FakeOllamaBackend(fail=True), {"messages": MESSAGES, "stream": True})
+    assert response.status_code == 500
+
+
+def test_streaming_through_scheduler():
+    response = post_chat(FakeOllamaBackend(reply="hello there", token_latency_ms=1),
+                         {"messages": MESSAGES, "stream": True})
+    assert response.status_code == 200
+    chunks = [json.loads(line) for line in response.text.splitlines()]
+    assert "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks) == "hello there"
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_non_streaming_through_scheduler():
+    response = post_chat(FakeOllamaBackend(reply="hello there", token_latency_ms=1), {"messages": MESSAGES})
+    assert response.status_code == 200
+    assert response.json()["choices"][0]["message"]["content"] == "hello there"
+
+
+def test_key_removed_after_verification_returns_401(monkeypatch):
+    monkeypatch.setattr(llm_api.QUOTAS, "is_valid", lambda api_key: True)
+
+    async def main():
+        transport = httpx.ASGITransport(app=llm_api.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/chat", params={"api_key": "removed"}, json={"messages": MESSAGES})
+
+    assert asyncio.run(main()).status_code == 401
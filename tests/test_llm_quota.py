@@ -0,0 +1,57 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from llm_quota import FairQueue, KeyQuota, KeyStore, QuotaExceededError, QuotaManager, UnknownKeyError
+
+
+def test_request_quota_throttles_with_headers():
+    quotas = QuotaManager(KeyStore(env_keys="a", default_quota=KeyQuota(requests_per_second=1, burst=2)))
+    quotas.admit("a", 10)
+    _, headers = quotas.admit("a", 10)
+    assert headers["X-RateLimit-Remaining-Requests"] == "0"
+    with pytest.raises(QuotaExceededError) as excinfo:
+        quotas.admit("a", 10)
+    assert excinfo.value.limit == "requests"
+
+
+def test_unused_tokens_are_refunded():
+    quotas = QuotaManager(KeyStore(env_keys="a", default_quota=KeyQuota(tokens_per_minute=1000)))
+    charged, _ = quotas.admit("a", 800)
+    quotas.settle("a", charged, 100)
+    quotas.admit("a", 800)
+
+
+def test_key_removed_by_hot_reload_is_unknown(tmp_path):
+    path = tmp_path / "keys.json"
+    path.write_text(json.dumps({"keys": {"a": {}, "b": {}}}), encoding="utf-8")
+    store = KeyStore(path=str(path), reload_interval=0)
+    quotas = QuotaManager(store)
+    assert quotas.is_valid("b")
+
+    path.write_text(json.dumps({"keys": {"a": {}}}), encoding="utf-8")
+    os.utime(path, (os.stat(path).st_atime, os.stat(path).st_mtime + 10))
+    with pytest.raises(UnknownKeyError):
+        quotas.admit("b", 10)
+
+
+def test_fair_queue_serves_keys_round_robin():
+    async def main():
+        queue = FairQueue(max_concurrency=1)
+        holder = await queue.acquire("busy")
+        order = []
+
+        async def request(key):
+            slot = await queue.acquire(key)
+            order.append(key)
+            slot.release()
+
+        tasks = [asyncio.create_task(request(key)) for key in ("busy", "busy", "busy", "other")]
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["busy", "other", "busy", "busy"]
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import FakeOllamaBackend, MicroBatchScheduler, QueueFullError
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, timeout=10))
+
+
+async def collect(chunks):
+    return "".join([chunk["message"]["content"] async for chunk in chunks])
+
+
+def test_scheduler_respects_max_concurrency_and_delivers_every_reply():
+    backend = FakeOllamaBackend(reply="one two three", token_latency_ms=2)
+
+    async def main():
+        scheduler = MicroBatchScheduler(backend, max_batch_size=4, max_wait_ms=5, max_concurrency=2)
+        await scheduler.start()
+        try:
+            streams = [await scheduler.submit({"model": "m", "options": {"seed": i % 2}}) for i in range(6)]
+            return await asyncio.gather(*(collect(stream) for stream in streams))
+        finally:
+            await scheduler.stop()
+
+    assert run(main()) == ["one two three"] * 6
+    assert len(backend.calls) == 6
+    assert backend.max_in_flight == 2
+
+
+def test_backend_failure_is_raised_to_the_caller():
+    async def main():
+        scheduler = MicroBatchScheduler(FakeOllamaBackend(fail=True))
+        await scheduler.start()
+        try:
+            await collect(await scheduler.submit({"model": "m"}))
+        finally:
+            await scheduler.stop()
+
+    with pytest.raises(RuntimeError, match="fake backend failure"):
+        run(main())
+
+
+def test_full_queue_rejects_without_blocking():
+    async def main():
+        # 不啟動派送迴圈，佇列只進不出
+        scheduler = MicroBatchScheduler(FakeOllamaBackend(), max_queue_size=1)
+        scheduler._queue = asyncio.Queue(maxsize=1)
+        await scheduler.submit({"model": "m"})
+        await scheduler.submit({"model": "m"})
+
+    with pytest.raises(QueueFullError):
+        run(main())
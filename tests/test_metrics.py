@@ -0,0 +1,61 @@
+import threading
+
+from ml_mlflow_provider.metrics import MetricsRegistry
+
+
+class InterleavingDict(dict):
+    """走訪到第一個項目時，讓另一個 thread 呼叫 on_iterate()（例如新增 label 組合）"""
+
+    on_iterate = None
+    thread = None
+
+    def items(self):
+        iterator = iter(super().items())
+        yield next(iterator)
+        if self.on_iterate is not None:
+            # 修正後寫入端會卡在 lock 上，逾時後繼續走訪
+            self.thread = threading.Thread(target=self.on_iterate)
+            self.thread.start()
+            self.thread.join(timeout=0.2)
+            self.on_iterate = None
+        yield from iterator
+
+
+def test_counter_snapshot_while_a_new_label_series_is_added():
+    registry = MetricsRegistry(enabled=True)
+    requests = registry.counter("requests_total", "Requests")
+    requests._values = InterleavingDict()
+    requests.inc(route="a")
+    requests.inc(route="b")
+    requests._values.on_iterate = lambda: requests.inc(route="c")
+
+    snapshot = registry.snapshot()
+    requests._values.thread.join()
+    assert snapshot['requests_total{route="a"}'] == 1
+    assert registry.snapshot()['requests_total{route="c"}'] == 1
+
+
+def test_histogram_render_while_a_new_label_series_is_added():
+    registry = MetricsRegistry(enabled=True)
+    latency = registry.histogram("latency_seconds", "Latency")
+    latency._series = InterleavingDict()
+    latency.observe(0.1, route="a")
+    latency.observe(0.2, route="b")
+    latency._series.on_iterate = lambda: latency.observe(0.3, route="c")
+
+    assert 'latency_seconds_count{route="a"} 1' in registry.render_prometheus()
+    latency._series.thread.join()
+    assert registry.snapshot()['latency_seconds_count{route="c"}'] == 1
+
+
+def test_histogram_render_is_cumulative():
+    registry = MetricsRegistry(enabled=True)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    text = registry.render_prometheus()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
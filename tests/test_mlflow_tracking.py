@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+pytest.importorskip("mlflow")
+
+import mlflow_tracking
+from mlflow_tracking import BufferedTracker, TrackingFlushError
+
+
+class FakeClient:
+    """記錄上傳內容；failures 指定各方法前幾次呼叫要失敗"""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.params = {}
+        self.metrics = []
+        self.artifacts = {}
+
+    def _maybe_fail(self, method):
+        if self.failures.get(method, 0) > 0:
+            self.failures[method] -= 1
+            raise ConnectionError(f"{method} failed")
+
+    def log_batch(self, run_id, metrics=(), params=()):
+        self._maybe_fail("log_batch")
+        self.params.update((param.key, param.value) for param in params)
+        self.metrics.extend((metric.key, metric.value) for metric in metrics)
+
+    def log_artifacts(self, run_id, local_dir):
+        self._maybe_fail("log_artifacts")
+        for root, _, files in os.walk(local_dir):
+            for name in files:
+                with open(os.path.join(root, name), encoding="utf-8") as f:
+                    self.artifacts[os.path.relpath(os.path.join(root, name), local_dir)] = f.read()
+
+
+def make_tracker(monkeypatch, client, **kwargs):
+    monkeypatch.setattr(mlflow_tracking, "MlflowClient", lambda: client)
+    return BufferedTracker("run-1", flush_interval=0.01, **kwargs)
+
+
+def test_one_failed_upload_is_retried_without_dropping_other_kinds(monkeypatch):
+    client = FakeClient(failures={"log_batch": 1})
+    with make_tracker(monkeypatch, client) as tracker:
+        tracker.log_params({"max_iteration": 3})
+        tracker.log_metric("iteration", 1, step=1)
+        tracker.log_text("final rules", artifact_file="final_rules.txt")
+
+    assert client.params == {"max_iteration": "3"}
+    assert client.metrics == [("iteration", 1.0)]
+    assert client.artifacts == {"final_rules.txt": "final rules"}
+
+
+def test_close_uploads_synchronously_after_background_retries_fail(monkeypatch):
+    client = FakeClient(failures={"log_artifacts": 2})
+    with make_tracker(monkeypatch, client, max_attempts=2) as tracker:
+        tracker.log_text("final rules", artifact_file="final_rules.txt")
+        tracker.flush()
+        assert client.artifacts == {}
+
+    assert client.artifacts == {"final_rules.txt": "final rules"}
+
+
+def test_close_raises_when_records_cannot_be_uploaded(monkeypatch):
+    client = FakeClient(failures={"log_batch": 100})
+    tracker = make_tracker(monkeypatch, client, max_attempts=2)
+    tracker.log_param("model", "llama")
+    with pytest.raises(TrackingFlushError) as excinfo:
+        tracker.close()
+    assert [kind for kind, _ in excinfo.value.records] == ["param"]
@@ -0,0 +1,27 @@
+import asyncio
+
+from ml_mlflow_provider import ndjson
+
+
+def parse(chunks, sse=False):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def main():
+        return [obj async for obj in ndjson.iter_ndjson(source(), sse=sse)]
+
+    return asyncio.run(main())
+
+
+def test_decoder_reassembles_lines_split_across_chunks():
+    assert parse([b'{"a":', b'1}\n\n{"b"', b':2}\r\n{"c":3}']) == [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+def test_sse_mode_strips_data_prefix_and_stops_at_done():
+    chunks = [b'data: {"a":1}\n', b"\n", b'data: {"b":', b"2}\n", b"data: [DONE]\n", b'data: {"c":3}\n']
+    assert parse(chunks, sse=True) == [{"a": 1}, {"b": 2}]
+
+
+def test_sse_mode_still_accepts_plain_ndjson():
+    assert parse([b'{"a":1}\n{"b":2}'], sse=True) == [{"a": 1}, {"b": 2}]
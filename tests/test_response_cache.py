@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+from ml_mlflow_provider.cache import ResponseCache
+
+
+def test_concurrent_identical_requests_count_as_one_miss():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"text": "answer"}
+
+    async def main():
+        cache = ResponseCache()
+        results = await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(5)))
+        await cache.get_or_fetch("k", fetch)
+        return cache, results
+
+    cache, results = asyncio.run(main())
+    stats = cache.stats()
+    assert results == [{"text": "answer"}] * 5
+    assert len(calls) == 1
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 1)
+    assert stats["hit_rate"] == 1 / 6
+    assert stats["backend_avoided_rate"] == 5 / 6
+
+
+def test_disk_tier_survives_restart_and_runs_off_the_event_loop(tmp_path, monkeypatch):
+    threads = set()
+    original_read, original_write = ResponseCache._read_disk, ResponseCache._write_disk
+
+    def read(self, key):
+        threads.add(threading.current_thread())
+        return original_read(self, key)
+
+    def write(self, key, expires_at, value):
+        threads.add(threading.current_thread())
+        return original_write(self, key, expires_at, value)
+
+    monkeypatch.setattr(ResponseCache, "_read_disk", read)
+    monkeypatch.setattr(ResponseCache, "_write_disk", write)
+
+    async def fetch():
+        return {"text": "from backend"}
+
+    async def main():
+        await ResponseCache(disk_path=str(tmp_path)).get_or_fetch("k", fetch)
+        restarted = ResponseCache(disk_path=str(tmp_path))
+        value = await restarted.get_or_fetch("k", fetch)
+        return restarted, value
+
+    restarted, value = asyncio.run(main())
+    assert value == {"text": "from backend"}
+    assert restarted.stats()["disk_hits"] == 1 and restarted.stats()["misses"] == 0
+    assert threads and threading.main_thread() not in threads
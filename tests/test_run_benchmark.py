@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("httpx")
+
+from benchmarks.run_benchmark import compare, percentile
+
+
+def results(**values):
+    base = {"duration_s": 10.0, "throughput_rps": 20.0, "latency_p99": 1.0, "error_rate": 0.0, "errors": {}}
+    return {"results": {**base, **values}}
+
+
+def test_faster_run_is_not_a_regression():
+    assert compare(results(duration_s=5.0, throughput_rps=40.0, latency_p99=0.5), results(), 0.1) == []
+
+
+def test_slower_run_is_reported():
+    regressions = compare(results(throughput_rps=15.0, latency_p99=1.5), results(), 0.1)
+    assert [name for name, *_ in regressions] == ["throughput_rps", "latency_p99"]
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
@@ -0,0 +1,114 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from prompt_registry import PromptRegistry
+from semantic_cache import HashedNgramEmbedder, SemanticCache
+
+PROMPTS = PromptRegistry()
+
+
+def make_library(cells=400):
+    return "".join(
+        f"cell (CELL_{i}) {{ area : {i}.25; pin (A) {{ direction : input; capacitance : 0.00{i % 9 + 1}; }} }}\n"
+        for i in range(cells)
+    )
+
+
+def make_rules(seed):
+    words = [f"rule_{seed}_{i}" for i in range(60)]
+    return "\n".join(f"{i}. Every pg_pin with {word} must define voltage_name." for i, word in enumerate(words))
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, answer):
+        def call():
+            self.calls.append(answer)
+            return answer
+        return call
+
+
+@pytest.mark.parametrize("semantic", [False, True])
+def test_shared_library_prefix_does_not_short_circuit_refinement(semantic):
+    """evaluate_rules 的 prompt 幾乎都是共同的 library_context，下一次迭代不可拿到上一次的回答"""
+    library = make_library()
+    cache = SemanticCache(threshold=0.97)
+    llm = Recorder()
+    prompts = [
+        PROMPTS.render("library_context", cell_group=library)
+        + PROMPTS.render("evaluate_rules", llm_response=make_rules(seed))
+        for seed in (1, 2)
+    ]
+    # 前提：以整個 prompt 計算時，不相關的兩組規則相似度超過 threshold
+    embedder = cache.embedder
+    assert float(embedder.embed(prompts[0]) @ embedder.embed(prompts[1])) > cache.threshold
+
+    answers = []
+    for iteration, prompt in enumerate(prompts):
+        answers.append(cache.get_or_call(
+            prompt, llm(f"refined-{iteration}"), namespace="evaluate_rules", scope="run-1", semantic=semantic,
+        ))
+
+    assert answers == ["refined-0", "refined-1"]
+    assert llm.calls == ["refined-0", "refined-1"]
+
+
+def test_similarity_uses_only_the_variable_text():
+    library = make_library()
+    cache = SemanticCache(threshold=0.97)
+    llm = Recorder()
+    first, second = make_rules(1), make_rules(2)
+
+    cache.get_or_call(library + first, llm("a"), namespace="evaluate_rules", embed_text=first, scope="run-1")
+    answer = cache.get_or_call(library + second, llm("b"), namespace="evaluate_rules", embed_text=second,
+                               scope="run-2")
+
+    assert answer == "b"
+    assert cache.stats()["hits"] == 0
+
+
+def test_same_scope_never_hits_even_for_identical_prompt():
+    cache = SemanticCache()
+    llm = Recorder()
+    assert cache.get_or_call("prompt", llm("first"), scope="run-1") == "first"
+    assert cache.get_or_call("prompt", llm("second"), scope="run-1") == "second"
+    # 其他 run 仍可命中
+    assert cache.get_or_call("prompt", llm("third"), scope="run-2") == "second"
+    assert llm.calls == ["first", "second"]
+
+
+def test_near_duplicate_cell_hits_across_runs():
+    cell = make_library(20)
+    similar_cell = cell.replace("area : 3.25", "area : 3.5")
+    cache = SemanticCache(threshold=0.97)
+    llm = Recorder()
+    stats = {}
+
+    cache.get_or_call("generate\n" + cell, llm("rules"), "generate_initial", embed_text=cell, scope="run-1")
+    answer = cache.get_or_call("generate\n" + similar_cell, llm("other"), "generate_initial", stats,
+                               embed_text=similar_cell, scope="run-2")
+
+    assert answer == "rules"
+    assert llm.calls == ["rules"]
+    assert stats["hits"] == 1 and stats["tokens_saved"] > 0
+
+
+def test_namespaces_do_not_mix_and_size_is_bounded():
+    cache = SemanticCache(max_entries=2)
+    llm = Recorder()
+    cache.get_or_call("same text", llm("generate"), "generate_initial")
+    assert cache.get_or_call("same text", llm("evaluate"), "evaluate_rules") == "evaluate"
+    cache.get_or_call("another text", llm("third"), "generate_initial")
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_hashed_ngram_embedding_is_normalized():
+    vector = HashedNgramEmbedder(dim=256).embed("pg_pin (VDD) { pg_type : primary_power; }")
+    assert vector.shape == (256,)
+    assert np.isclose(np.linalg.norm(vector), 1.0)